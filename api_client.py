@@ -5,26 +5,382 @@ API客户端模块，用于调用OCR或大模型API进行图像文本识别
 """
 
 import os
-import requests
 import json
 import base64
 import time
-from typing import Dict, Any, List, Optional
+import random
+import asyncio
+import mmap
+import hashlib
+import functools
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import requests
+
+try:
+    # pybase64使用SIMD加速base64编码，未安装时回退到标准库
+    import pybase64
+except ImportError:
+    pybase64 = None
+
+try:
+    # orjson的序列化和解析比标准库json快数倍，未安装时回退到标准库
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    # httpx支持HTTP/2多路复用，用于OpenAI客户端的异步请求，未安装时使用线程池
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    # xxhash用于计算图像内容哈希，未安装时回退到blake2b
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# OCR结果缓存目录
+_OCR_CACHE_DIR = "~/.cache/pdf2epub/ocr"
+
+# 序列化请求体时代替图像数据的占位符
+_IMAGE_DATA_PLACEHOLDER = "__PDF2EPUB_IMAGE_DATA__"
+
+
+def _b64encode_str(data) -> str:
+    """
+    将二进制数据编码为base64字符串
+    
+    参数:
+        data: 二进制数据
+        
+    返回:
+        str: base64编码字符串
+    """
+    if pybase64 is not None:
+        return pybase64.b64encode_as_string(data)
+    return base64.b64encode(data).decode("ascii")
+
+
+def _json_dumps(obj) -> bytes:
+    """
+    将对象序列化为UTF-8编码的JSON
+    
+    参数:
+        obj: 要序列化的对象
+        
+    返回:
+        bytes: JSON数据
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+def _json_loads(data):
+    """
+    解析JSON数据
+    
+    参数:
+        data: JSON数据（bytes或str）
+        
+    返回:
+        解析后的对象
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _encode_image_file(image_path: str) -> str:
+    """
+    读取图像文件并编码为base64字符串
+    
+    通过mmap直接对文件映射进行编码，避免read()在内存中多保留一份原始图像数据。
+    
+    参数:
+        image_path: 图像文件路径
+        
+    返回:
+        str: base64编码字符串
+    """
+    with open(image_path, "rb") as f:
+        # 空文件无法进行mmap
+        if os.fstat(f.fileno()).st_size == 0:
+            return ""
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return _b64encode_str(mm)
+
+
+def _new_hasher():
+    """
+    创建用于图像内容哈希的哈希对象
+    
+    返回:
+        哈希对象，优先使用xxh3_128，未安装xxhash时使用blake2b
+    """
+    return xxhash.xxh3_128() if xxhash is not None else hashlib.blake2b(digest_size=16)
+
+
+def _prepare_image(image_path: str) -> Tuple[str, str]:
+    """
+    读取图像文件，计算内容哈希并进行base64编码
+    
+    在批量模式下于子进程中执行，编码的CPU开销与其他页面的网络请求重叠。
+    
+    参数:
+        image_path: 图像文件路径
+        
+    返回:
+        Tuple[str, str]: (内容哈希, base64编码字符串)
+    """
+    with open(image_path, "rb") as f:
+        data = f.read()
+    hasher = _new_hasher()
+    hasher.update(data)
+    return hasher.hexdigest(), _b64encode_str(data)
+
+
+def _cache_path(namespace: str, digest: str) -> Path:
+    """
+    获取识别结果缓存文件路径
+    
+    参数:
+        namespace: 缓存命名空间（客户端类名和API地址哈希）
+        digest: 图像内容哈希
+        
+    返回:
+        Path: 缓存文件路径
+    """
+    return Path(os.path.expanduser(_OCR_CACHE_DIR)) / namespace / f"{digest}.txt"
+
+
+def _read_cache(namespace: str, digest: str) -> Optional[str]:
+    """
+    读取缓存的识别结果
+    
+    参数:
+        namespace: 缓存命名空间（客户端类名和API地址哈希）
+        digest: 图像内容哈希
+        
+    返回:
+        Optional[str]: 缓存的文本，未命中时返回None
+    """
+    try:
+        return _cache_path(namespace, digest).read_text(encoding="utf-8")
+    except OSError:
+        return None
+
+
+def _write_cache(namespace: str, digest: str, text: str):
+    """
+    写入识别结果缓存
+    
+    参数:
+        namespace: 缓存命名空间（客户端类名和API地址哈希）
+        digest: 图像内容哈希
+        text: 识别出的文本
+    """
+    # 不缓存空结果（如接口返回的content为null），避免识别失败的页面在之后的运行中一直被跳过
+    if not isinstance(text, str) or not text:
+        return
+    
+    cache_path = _cache_path(namespace, digest)
+    # 先写入临时文件再替换，避免并发读取到不完整的结果
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=cache_path.parent, suffix=".tmp")
+    except OSError:
+        # 缓存写入失败不影响识别流程
+        return
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(temp_path, cache_path)
+    except Exception:
+        # 缓存写入失败不影响识别流程，只需删除未完成的临时文件
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+
+
+def _recognize_cached(client: "APIClient", digest: str, image_base64: str) -> str:
+    """
+    按图像内容哈希查找缓存的识别结果，未命中时识别并写入缓存
+    
+    参数:
+        client: API客户端
+        digest: 图像内容哈希
+        image_base64: base64编码的图像数据
+        
+    返回:
+        str: 识别出的文本
+    """
+    namespace = client._cache_namespace()
+    if namespace is not None and (cached := _read_cache(namespace, digest)) is not None:
+        return cached
+    
+    text = client.recognize_base64(image_base64)
+    if namespace is not None:
+        _write_cache(namespace, digest, text)
+    return text
+
+
+async def _recognize_cached_async(client: "APIClient", digest: str, image_base64: str,
+                                  rate_limiter: Optional["_RateLimiter"] = None) -> str:
+    """
+    _recognize_cached的异步版本，缓存命中时不占用限速额度
+    
+    参数:
+        client: API客户端
+        digest: 图像内容哈希
+        image_base64: base64编码的图像数据
+        rate_limiter: 发送请求前等待的限速器，None表示不限制
+        
+    返回:
+        str: 识别出的文本
+    """
+    namespace = client._cache_namespace()
+    if namespace is not None and (cached := _read_cache(namespace, digest)) is not None:
+        return cached
+    
+    if rate_limiter:
+        await rate_limiter.wait()
+    text = await client.recognize_base64_async(image_base64)
+    if namespace is not None:
+        _write_cache(namespace, digest, text)
+    return text
+
+
+def _disk_cache(func):
+    """
+    按图像内容哈希将识别结果缓存到磁盘的装饰器
+    
+    缓存按客户端类名和API地址分目录存放，重复页面和重复运行可直接返回结果。
+    被装饰的方法须等价于对编码后的图像调用recognize_base64：启用缓存时只读取一次文件，
+    同时计算哈希和进行编码，未命中时直接调用recognize_base64。
+    """
+    @functools.wraps(func)
+    def wrapper(self, image_path):
+        if self._cache_namespace() is None:
+            return func(self, image_path)
+        return _recognize_cached(self, *_prepare_image(image_path))
+    return wrapper
+
 
 class APIClient:
     """
     API客户端基类
     """
-    def __init__(self, api_key: str = None, api_url: str = None):
+    # 限流(429)或服务端错误(5xx)时的重试参数
+    max_retries = 3
+    retry_base_wait = 1.0
+    retry_max_wait = 30.0
+    
+    # 识别结果是否可以按图像内容缓存
+    cache_results = True
+    
+    def __init__(self, api_key: str = None, api_url: str = None, cache: bool = True):
         """
         初始化API客户端
         
         参数:
             api_key: API密钥
             api_url: API地址
+            cache: 是否将识别结果缓存到磁盘
         """
         self.api_key = api_key
         self.api_url = api_url
+        if not cache:
+            self.cache_results = False
+        
+        # requests及其依赖的导入开销较大，仅在创建客户端时导入，
+        # 使只处理本地文本的命令行调用无需加载网络库
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        
+        # 复用连接池和keep-alive，避免每页都重新建立TCP/TLS连接
+        # 只重试请求尚未发出的连接错误，HTTP状态码的重试见_call_with_retry；
+        # 读取超时等错误时服务端可能已处理并计费，不能重发OCR的POST请求
+        self.session = requests.Session()
+        retry = Retry(total=3, connect=3, read=0, status=0, backoff_factor=0.5)
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+    
+    def close(self):
+        """
+        关闭客户端，释放连接池
+        """
+        self.session.close()
+    
+    def _cache_namespace(self) -> Optional[str]:
+        """
+        获取识别结果缓存的命名空间
+        
+        不同地址的接口可能对应不同的模型，按客户端类名和API地址的哈希分开存放。
+        
+        返回:
+            Optional[str]: 命名空间，未启用缓存时返回None
+        """
+        if not self.cache_results:
+            return None
+        url_hash = hashlib.blake2b((self.api_url or "").encode("utf-8"), digest_size=4).hexdigest()
+        return f"{type(self).__name__}-{url_hash}"
+    
+    def _call_with_retry(self, method: str, url: str, **kwargs) -> "requests.Response":
+        """
+        发送HTTP请求，遇到限流或服务端错误时指数退避重试
+        
+        参数:
+            method: 请求方法
+            url: 请求地址
+            **kwargs: 传递给requests的其他参数
+            
+        返回:
+            requests.Response: 最后一次请求的响应
+        """
+        for attempt in range(self.max_retries + 1):
+            response = self.session.request(method, url, **kwargs)
+            if response.status_code != 429 and response.status_code < 500:
+                return response
+            if attempt == self.max_retries:
+                break
+            time.sleep(self._retry_wait(attempt))
+        
+        return response
+    
+    def _retry_wait(self, attempt: int) -> float:
+        """
+        计算第attempt次重试前的等待时间
+        
+        参数:
+            attempt: 已失败的请求次数减一
+            
+        返回:
+            float: 等待秒数
+        """
+        # 指数退避并加入随机抖动，避免并发请求同时重试
+        return min(self.retry_max_wait, self.retry_base_wait * 2 ** attempt) + random.random()
+    
+    async def aclose(self):
+        """
+        释放异步请求使用的资源
+        """
+        pass
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
     
     def recognize_text(self, image_path: str) -> str:
         """
@@ -37,13 +393,57 @@ class APIClient:
             str: 识别出的文本
         """
         raise NotImplementedError("子类必须实现此方法")
+    
+    def recognize_base64(self, image_base64: str) -> str:
+        """
+        识别已进行base64编码的图像中的文本
+        
+        参数:
+            image_base64: base64编码的图像数据
+            
+        返回:
+            str: 识别出的文本
+        """
+        raise NotImplementedError("子类必须实现此方法")
+    
+    async def recognize_text_async(self, image_path: str) -> str:
+        """
+        异步识别图像中的文本
+        
+        默认在线程池中执行同步的recognize_text，网络等待期间不阻塞事件循环，
+        从而可以并发处理多个页面。
+        
+        参数:
+            image_path: 图像文件路径
+            
+        返回:
+            str: 识别出的文本
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.recognize_text, image_path)
+    
+    async def recognize_base64_async(self, image_base64: str) -> str:
+        """
+        异步识别已进行base64编码的图像中的文本
+        
+        默认在线程池中执行同步的recognize_base64。
+        
+        参数:
+            image_base64: base64编码的图像数据
+            
+        返回:
+            str: 识别出的文本
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.recognize_base64, image_base64)
 
 
 class BaiduOCRClient(APIClient):
     """
     百度OCR API客户端
     """
-    def __init__(self, api_key: str, secret_key: str, api_url: str = "https://aip.baidubce.com/rest/2.0/ocr/v1/general_basic"):
+    def __init__(self, api_key: str, secret_key: str, api_url: str = "https://aip.baidubce.com/rest/2.0/ocr/v1/general_basic",
+                 cache: bool = True):
         """
         初始化百度OCR API客户端
         
@@ -51,11 +451,61 @@ class BaiduOCRClient(APIClient):
             api_key: API Key
             secret_key: Secret Key
             api_url: API地址
+            cache: 是否将识别结果缓存到磁盘
         """
-        super().__init__(api_key, api_url)
+        super().__init__(api_key, api_url, cache)
         self.secret_key = secret_key
         self.access_token = None
         self.token_expires = 0
+        
+        # 访问令牌持久化到磁盘，避免每次运行都重新认证
+        self._token_path = Path(os.path.expanduser("~/.cache/pdf2epub/baidu_token.json"))
+        self._load_cached_token()
+    
+    def _load_cached_token(self):
+        """
+        从磁盘加载未过期的访问令牌
+        """
+        try:
+            cached = _json_loads(self._token_path.read_bytes())
+        except (OSError, ValueError):
+            return
+        
+        # 只使用同一API Key获取且未过期的令牌
+        if cached.get("api_key_hash") == self._api_key_hash() and cached.get("expires", 0) > time.time():
+            self.access_token = cached.get("access_token")
+            self.token_expires = cached["expires"]
+    
+    def _save_cached_token(self):
+        """
+        将访问令牌保存到磁盘
+        
+        令牌是访问凭据，文件只允许当前用户读写，且不保存原始API Key。
+        """
+        data = _json_dumps({
+            "api_key_hash": self._api_key_hash(),
+            "access_token": self.access_token,
+            "expires": self.token_expires
+        })
+        # mkstemp创建的临时文件权限为0600，写完后再替换，避免并发读取到不完整的内容
+        try:
+            self._token_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self._token_path.parent, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, self._token_path)
+        except OSError:
+            # 缓存写入失败不影响识别流程
+            pass
+    
+    def _api_key_hash(self) -> str:
+        """
+        计算API Key的哈希，用于判断缓存的令牌是否属于当前API Key
+        
+        返回:
+            str: 十六进制哈希值
+        """
+        return hashlib.sha256((self.api_key or "").encode("utf-8")).hexdigest()
     
     def _get_access_token(self) -> str:
         """
@@ -70,17 +520,19 @@ class BaiduOCRClient(APIClient):
         
         # 获取新令牌
         token_url = f"https://aip.baidubce.com/oauth/2.0/token?grant_type=client_credentials&client_id={self.api_key}&client_secret={self.secret_key}"
-        response = requests.get(token_url)
-        result = response.json()
+        response = self._call_with_retry("GET", token_url)
+        result = _json_loads(response.content)
         
         if "access_token" in result:
             self.access_token = result["access_token"]
             # 令牌有效期通常为30天，这里设置为29天以确保安全
             self.token_expires = time.time() + 29 * 24 * 60 * 60
+            self._save_cached_token()
             return self.access_token
         else:
             raise Exception(f"获取访问令牌失败: {result}")
     
+    @_disk_cache
     def recognize_text(self, image_path: str) -> str:
         """
         使用百度OCR API识别图像中的文本
@@ -88,6 +540,19 @@ class BaiduOCRClient(APIClient):
         参数:
             image_path: 图像文件路径
             
+        返回:
+            str: 识别出的文本
+        """
+        # 读取图像文件并进行base64编码
+        return self.recognize_base64(_encode_image_file(image_path))
+    
+    def recognize_base64(self, image_base64: str) -> str:
+        """
+        使用百度OCR API识别已编码图像中的文本
+        
+        参数:
+            image_base64: base64编码的图像数据
+            
         返回:
             str: 识别出的文本
         """
@@ -97,18 +562,11 @@ class BaiduOCRClient(APIClient):
         # 准备请求
         request_url = f"{self.api_url}?access_token={access_token}"
         
-        # 读取图像文件
-        with open(image_path, "rb") as f:
-            image_data = f.read()
-        
-        # 对图像进行base64编码
-        image_base64 = base64.b64encode(image_data).decode("utf-8")
-        
         # 发送请求
         headers = {"Content-Type": "application/x-www-form-urlencoded"}
         params = {"image": image_base64}
-        response = requests.post(request_url, headers=headers, data=params)
-        result = response.json()
+        response = self._call_with_retry("POST", request_url, headers=headers, data=params)
+        result = _json_loads(response.content)
         
         # 解析结果
         if "words_result" in result:
@@ -123,7 +581,8 @@ class TencentOCRClient(APIClient):
     """
     腾讯OCR API客户端
     """
-    def __init__(self, secret_id: str, secret_key: str, api_url: str = "https://ocr.tencentcloudapi.com"):
+    def __init__(self, secret_id: str, secret_key: str, api_url: str = "https://ocr.tencentcloudapi.com",
+                 cache: bool = True):
         """
         初始化腾讯OCR API客户端
         
@@ -131,10 +590,14 @@ class TencentOCRClient(APIClient):
             secret_id: 密钥ID
             secret_key: 密钥
             api_url: API地址
+            cache: 是否将识别结果缓存到磁盘
         """
-        super().__init__(secret_id, api_url)
+        super().__init__(secret_id, api_url, cache)
         self.secret_key = secret_key
     
+    # 示例实现只返回占位符，不应写入结果缓存
+    cache_results = False
+    
     def recognize_text(self, image_path: str) -> str:
         """
         使用腾讯OCR API识别图像中的文本
@@ -142,6 +605,19 @@ class TencentOCRClient(APIClient):
         参数:
             image_path: 图像文件路径
             
+        返回:
+            str: 识别出的文本
+        """
+        # 读取图像文件并进行base64编码
+        return self.recognize_base64(_encode_image_file(image_path))
+    
+    def recognize_base64(self, image_base64: str) -> str:
+        """
+        使用腾讯OCR API识别已编码图像中的文本
+        
+        参数:
+            image_base64: base64编码的图像数据
+            
         返回:
             str: 识别出的文本
         """
@@ -149,13 +625,6 @@ class TencentOCRClient(APIClient):
         # 由于需要使用腾讯云SDK，这里只提供一个示例框架
         # 实际使用时需要安装腾讯云SDK并完善此方法
         
-        # 读取图像文件
-        with open(image_path, "rb") as f:
-            image_data = f.read()
-        
-        # 对图像进行base64编码
-        image_base64 = base64.b64encode(image_data).decode("utf-8")
-        
         # 这里应该使用腾讯云SDK发送请求
         # 以下代码仅为示例，实际使用时需要替换
         """
@@ -188,16 +657,23 @@ class OpenAIVisionClient(APIClient):
     """
     OpenAI Vision API客户端
     """
-    def __init__(self, api_key: str, api_url: str = "https://api.openai.com/v1/chat/completions"):
+    def __init__(self, api_key: str, api_url: str = "https://api.openai.com/v1/chat/completions",
+                 cache: bool = True):
         """
         初始化OpenAI Vision API客户端
         
         参数:
             api_key: API密钥
             api_url: API地址
+            cache: 是否将识别结果缓存到磁盘
         """
-        super().__init__(api_key, api_url)
+        super().__init__(api_key, api_url, cache)
+        
+        # 异步请求使用的httpx客户端，与创建它的事件循环绑定
+        self._async_client = None
+        self._async_loop = None
     
+    @_disk_cache
     def recognize_text(self, image_path: str) -> str:
         """
         使用OpenAI Vision API识别图像中的文本
@@ -208,14 +684,118 @@ class OpenAIVisionClient(APIClient):
         返回:
             str: 识别出的文本
         """
-        # 读取图像文件
-        with open(image_path, "rb") as f:
-            image_data = f.read()
+        # 读取图像文件并进行base64编码
+        return self.recognize_base64(_encode_image_file(image_path))
+    
+    def recognize_base64(self, image_base64: str) -> str:
+        """
+        使用OpenAI Vision API识别已编码图像中的文本
+        
+        参数:
+            image_base64: base64编码的图像数据
+            
+        返回:
+            str: 识别出的文本
+        """
+        headers, body = self._build_request(image_base64)
+        response = self._call_with_retry("POST", self.api_url, headers=headers, data=body)
+        return self._parse_result(_json_loads(response.content))
+    
+    async def recognize_text_async(self, image_path: str) -> str:
+        """
+        异步识别图像中的文本
+        
+        安装httpx时通过HTTP/2在同一连接上复用并发请求，否则在线程池中执行。
+        
+        参数:
+            image_path: 图像文件路径
+            
+        返回:
+            str: 识别出的文本
+        """
+        if httpx is None:
+            return await super().recognize_text_async(image_path)
         
-        # 对图像进行base64编码
-        image_base64 = base64.b64encode(image_data).decode("utf-8")
+        loop = asyncio.get_running_loop()
+        digest, image_base64 = await loop.run_in_executor(None, _prepare_image, image_path)
+        return await _recognize_cached_async(self, digest, image_base64)
+    
+    async def recognize_base64_async(self, image_base64: str) -> str:
+        """
+        异步识别已编码图像中的文本
         
-        # 准备请求
+        参数:
+            image_base64: base64编码的图像数据
+            
+        返回:
+            str: 识别出的文本
+        """
+        if httpx is None:
+            return await super().recognize_base64_async(image_base64)
+        
+        headers, body = self._build_request(image_base64)
+        client = await self._get_async_client()
+        for attempt in range(self.max_retries + 1):
+            response = await client.post(self.api_url, headers=headers, content=body)
+            if response.status_code != 429 and response.status_code < 500:
+                break
+            if attempt == self.max_retries:
+                break
+            await asyncio.sleep(self._retry_wait(attempt))
+        
+        return self._parse_result(_json_loads(response.content))
+    
+    async def _get_async_client(self):
+        """
+        获取当前事件循环使用的httpx异步客户端
+        
+        事件循环改变时（如多次调用asyncio.run）先关闭绑定在旧事件循环上的客户端。
+        
+        返回:
+            httpx.AsyncClient: 异步客户端
+        """
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_loop is not loop:
+            old_client = self._async_client
+            options = {
+                "timeout": httpx.Timeout(60.0),
+                "limits": httpx.Limits(max_connections=32, max_keepalive_connections=32)
+            }
+            try:
+                self._async_client = httpx.AsyncClient(http2=True, **options)
+            except ImportError:
+                # 未安装h2时退回HTTP/1.1连接池
+                self._async_client = httpx.AsyncClient(**options)
+            self._async_loop = loop
+            
+            # 新客户端就绪后再关闭旧客户端，等待期间并发的请求不会重复创建客户端
+            if old_client is not None:
+                try:
+                    await old_client.aclose()
+                except Exception:
+                    # 旧事件循环已关闭时部分连接无法正常关闭，剩余的由垃圾回收释放
+                    pass
+        return self._async_client
+    
+    async def aclose(self):
+        """
+        关闭httpx异步客户端
+        """
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+            self._async_loop = None
+    
+    def _build_request(self, image_base64: str):
+        """
+        构建请求头和请求体
+        
+        参数:
+            image_base64: base64编码的图像数据
+            
+        返回:
+            Tuple[Dict[str, str], bytes]: (请求头, 请求体)
+        """
         headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.api_key}"
@@ -235,7 +815,7 @@ class OpenAIVisionClient(APIClient):
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
+                                "url": _IMAGE_DATA_PLACEHOLDER
                             }
                         }
                     ]
@@ -244,19 +824,100 @@ class OpenAIVisionClient(APIClient):
             "max_tokens": 4096
         }
         
-        # 发送请求
-        response = requests.post(self.api_url, headers=headers, json=payload)
-        result = response.json()
+        # base64数据不含需要转义的字符，序列化时先用占位符代替，
+        # 再将其直接拼接进请求体，避免数MB的字符串经过JSON转义
+        body = _json_dumps(payload)
+        prefix, suffix = body.split(_IMAGE_DATA_PLACEHOLDER.encode("ascii"), 1)
+        body = b"".join((prefix, b"data:image/jpeg;base64,", image_base64.encode("ascii"), suffix))
+        return headers, body
+    
+    def _parse_result(self, result: Dict[str, Any]) -> str:
+        """
+        从响应中提取识别出的文本
         
-        # 解析结果
+        参数:
+            result: 解析后的响应数据
+            
+        返回:
+            str: 识别出的文本
+        """
         if "choices" in result and len(result["choices"]) > 0:
-            text = result["choices"][0]["message"]["content"]
-            return text
+            return result["choices"][0]["message"]["content"]
         else:
             error_msg = result.get("error", {}).get("message", "未知错误")
             raise Exception(f"文本识别失败: {error_msg}")
 
 
+class _RateLimiter:
+    """
+    按固定的最小请求间隔限制每秒请求数
+    """
+    def __init__(self, max_rps: float):
+        self._interval = 1.0 / max_rps
+        self._next_time = 0.0
+        self._lock = asyncio.Lock()
+    
+    async def wait(self):
+        """
+        等待直到允许发出下一个请求
+        """
+        async with self._lock:
+            now = time.monotonic()
+            if self._next_time > now:
+                await asyncio.sleep(self._next_time - now)
+            self._next_time = max(now, self._next_time) + self._interval
+
+
+async def recognize_batch(client: APIClient, image_paths: List[str], concurrency: Optional[int] = None,
+                          max_rps: Optional[float] = None, encode_workers: Optional[int] = None) -> List[str]:
+    """
+    并发识别多个图像中的文本
+    
+    参数:
+        client: API客户端
+        image_paths: 图像文件路径列表
+        concurrency: 同时进行的最大请求数，默认读取环境变量OCR_CONCURRENCY（未设置时为8）
+        max_rps: 每秒最大请求数，None表示不限制
+        encode_workers: 用于图像哈希和base64编码的进程数，0表示使用CPU核数，
+            None表示在请求线程中编码；启用时客户端需实现recognize_base64
+        
+    返回:
+        List[str]: 识别出的文本列表，顺序与image_paths一致
+    """
+    if concurrency is None:
+        concurrency = int(os.environ.get("OCR_CONCURRENCY", "8"))
+    semaphore = asyncio.Semaphore(concurrency)
+    rate_limiter = _RateLimiter(max_rps) if max_rps else None
+    loop = asyncio.get_running_loop()
+    pool = ProcessPoolExecutor(max_workers=encode_workers or os.cpu_count()) if encode_workers is not None else None
+    
+    async def _recognize(image_path):
+        async with semaphore:
+            if pool is None:
+                if rate_limiter:
+                    await rate_limiter.wait()
+                return await client.recognize_text_async(image_path)
+            
+            # 编码在子进程中进行，与其他页面的网络请求重叠；
+            # 放在信号量内可将内存中的base64数据限制在并发数以内
+            digest, image_base64 = await loop.run_in_executor(pool, _prepare_image, image_path)
+            return await _recognize_cached_async(client, digest, image_base64, rate_limiter)
+    
+    tasks = [asyncio.ensure_future(_recognize(path)) for path in image_paths]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        # 某一页失败时取消其余页面并等待其结束，避免在请求进行中关闭客户端
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if pool is not None:
+            # 等待工作进程退出会阻塞，放到线程中进行以免阻塞事件循环
+            await loop.run_in_executor(None, pool.shutdown)
+        # 异步客户端与本次事件循环绑定，结束时一并释放
+        await client.aclose()
+
+
 # 工厂函数，根据API类型创建相应的客户端
 def create_api_client(api_type: str, **kwargs) -> APIClient:
     """
@@ -273,18 +934,21 @@ def create_api_client(api_type: str, **kwargs) -> APIClient:
         return BaiduOCRClient(
             api_key=kwargs.get("api_key"),
             secret_key=kwargs.get("secret_key"),
-            api_url=kwargs.get("api_url", "https://aip.baidubce.com/rest/2.0/ocr/v1/general_basic")
+            api_url=kwargs.get("api_url", "https://aip.baidubce.com/rest/2.0/ocr/v1/general_basic"),
+            cache=kwargs.get("cache", True)
         )
     elif api_type.lower() == "tencent":
         return TencentOCRClient(
             secret_id=kwargs.get("secret_id"),
             secret_key=kwargs.get("secret_key"),
-            api_url=kwargs.get("api_url", "https://ocr.tencentcloudapi.com")
+            api_url=kwargs.get("api_url", "https://ocr.tencentcloudapi.com"),
+            cache=kwargs.get("cache", True)
         )
     elif api_type.lower() == "openai":
         return OpenAIVisionClient(
             api_key=kwargs.get("api_key"),
-            api_url=kwargs.get("api_url", "https://api.openai.com/v1/chat/completions")
+            api_url=kwargs.get("api_url", "https://api.openai.com/v1/chat/completions"),
+            cache=kwargs.get("cache", True)
         )
     else:
         raise ValueError(f"不支持的API类型: {api_type}")
@@ -5,18 +5,275 @@ EPUB构建器模块
 """
 
 import os
+import io
+import asyncio
+import array
 import logging
+import functools
+import hashlib
 import zipfile
 import subprocess
 import uuid
 import shutil
 import tempfile
-from datetime import datetime
-from unittest.mock import MagicMock
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+# pyvips为可选依赖，安装后使用libvips按块流式解码和缩放图像
+try:
+    import pyvips
+except (ImportError, OSError):
+    pyvips = None
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 页面类型对应的标题模板，{}为页面序号
+_PAGE_TITLES = {
+    "cover": "封面",
+    "toc": "目录",
+    "chapter": "第{}章",
+    "section": "第{}节",
+}
+
+# 章节XHTML的固定片段，预先编码后直接写入压缩流
+_CHAPTER_HEAD = b"""<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">
+<head>
+    <title>"""
+_CHAPTER_HEAD_END = b"""</title>
+    <link rel="stylesheet" type="text/css" href="styles/main.css"/>
+    <meta charset="UTF-8"/>
+</head>
+<body>
+    """
+_CHAPTER_TAIL = b"""
+</body>
+</html>"""
+# 章节正文之前的部分合并为一个字节模板，只需填入标题和级别
+_CHAPTER_HEADER = _CHAPTER_HEAD + b"%s" + _CHAPTER_HEAD_END + b"<h%d>%s</h%d>\n    "
+
+# mimetype和META-INF/container.xml内容固定，预先编码
+_MIMETYPE = b"application/epub+zip"
+_CONTAINER_XML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+    <rootfiles>
+        <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+    </rootfiles>
+</container>"""
+
+# EPUB先在内存中构建，超过该大小才转存到临时文件
+_SPOOL_MAX_SIZE = 16 * 1024 * 1024
+# 写出EPUB文件时的缓冲区大小
+_COPY_BUFFER_SIZE = 1024 * 1024
+
+# 共享内存文件系统，生成MOBI时中间EPUB文件写在这里，不经过磁盘
+_SHM_DIR = "/dev/shm"
+
+# MOBI转换失败时记录的错误输出长度
+_STDERR_TAIL_SIZE = 4096
+
+# 从文件添加图像时读取的文件头大小，足以覆盖EXIF等位于帧头之前的段
+_IMAGE_HEADER_SIZE = 128 * 1024
+
+# CSS模板目录，导入时计算一次
+_TEMPLATES_DIR = Path(__file__).resolve().parent.parent / "templates"
+
+# OPF/NCX使用的XML命名空间，以xmlns属性直接写在元素上，保留常用前缀
+_OPF_NS = "http://www.idpf.org/2007/opf"
+_DC_NS = "http://purl.org/dc/elements/1.1/"
+_NCX_NS = "http://www.daisy.org/z3986/2005/ncx/"
+
+_XML_DECLARATION = b'<?xml version="1.0" encoding="UTF-8"?>\n'
+
+# 图像MIME类型对应的文件扩展名
+_IMAGE_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+}
+
+# 图像文件头签名对应的MIME类型
+_IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF8", "image/gif"),
+)
+
+# 找不到CSS模板时使用的默认样式
+_DEFAULT_CSS = """
+        body {
+            font-family: "Source Han Serif CN", serif;
+            line-height: 1.5;
+            margin: 0 5%;
+        }
+        h1, h2, h3, h4, h5, h6 {
+            font-weight: bold;
+            margin: 1em 0 0.5em 0;
+        }
+        h1 { font-size: 1.5em; text-align: center; }
+        h2 { font-size: 1.3em; }
+        h3 { font-size: 1.1em; }
+        p { margin: 0.5em 0; text-indent: 2em; }
+        .cover { text-align: center; margin: 0; padding: 0; }
+        .cover img { max-width: 100%; }
+        .footnote { font-size: 0.9em; color: #666; }
+        table { border-collapse: collapse; width: 100%; margin: 1em 0; }
+        th, td { border: 1px solid #ddd; padding: 0.5em; }
+        th { background-color: #f2f2f2; }
+        """
+
+
+@functools.lru_cache(maxsize=16)
+def _load_css_template(name):
+    """
+    按名称加载CSS模板，结果按名称缓存
+    
+    参数:
+        name: CSS模板名称
+        
+    返回:
+        str: CSS内容
+    """
+    # 查找模板文件
+    template_path = _TEMPLATES_DIR / f"{name}.css"
+    
+    if template_path.is_file():
+        return template_path.read_text(encoding="utf-8")
+    else:
+        logger.warning(f"CSS模板不存在: {template_path}，使用默认样式")
+        # 返回默认CSS
+        return _DEFAULT_CSS
+
+
+@functools.lru_cache(maxsize=16)
+def _load_css_bytes(name):
+    """
+    按名称加载UTF-8编码的CSS模板，结果按名称缓存
+    
+    参数:
+        name: CSS模板名称
+        
+    返回:
+        bytes: CSS内容
+    """
+    return _load_css_template(name).encode("utf-8")
+
+
+# 帧头(SOF)标记，其中保存了JPEG的宽高（C4/C8/CC不是帧头）
+_JPEG_SOF_MARKERS = frozenset({0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+                               0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF})
+
+
+def _jpeg_size(image_data):
+    """
+    从JPEG文件头中读取图像尺寸，不解码任何像素数据
+    
+    参数:
+        image_data: 图像数据
+        
+    返回:
+        tuple: (宽度, 高度)，不是JPEG或无法解析时返回None
+    """
+    if image_data[:2] != b"\xff\xd8":
+        return None
+    
+    pos = 2
+    size = len(image_data)
+    while pos + 4 <= size:
+        if image_data[pos] != 0xFF:
+            return None
+        marker = image_data[pos + 1]
+        # 填充字节
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker in _JPEG_SOF_MARKERS:
+            if pos + 9 > size:
+                return None
+            height = int.from_bytes(image_data[pos + 5:pos + 7], "big")
+            width = int.from_bytes(image_data[pos + 7:pos + 9], "big")
+            return (width, height)
+        # 跳过带长度的段
+        pos += 2 + int.from_bytes(image_data[pos + 2:pos + 4], "big")
+    
+    return None
+
+
+def _image_mime_type(image_data, default):
+    """
+    根据文件头判断图像数据的实际格式
+    
+    调整大小后PNG/GIF会被重新编码为JPEG，清单中的扩展名和MIME类型应以实际写入的数据为准。
+    
+    参数:
+        image_data: 图像数据
+        default: 无法识别时使用的MIME类型
+        
+    返回:
+        str: MIME类型
+    """
+    header = bytes(image_data[:8])
+    for signature, mime_type in _IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return mime_type
+    return default
+
+
+def _resize_image(image_data, max_width, max_height, quality):
+    """
+    将图像缩放到指定尺寸以内并编码为JPEG
+    
+    定义在模块级别，以便在子进程中执行。
+    
+    参数:
+        image_data: 图像数据
+        max_width: 最大宽度
+        max_height: 最大高度
+        quality: JPEG质量（1-100）
+        
+    返回:
+        bytes: 调整后的图像数据
+    """
+    # 尺寸已符合要求的JPEG无需解码和重新编码，直接使用原始数据
+    # 尺寸从文件头的SOF段读取，连PIL都不需要
+    jpeg_size = _jpeg_size(image_data)
+    if jpeg_size is not None and jpeg_size[0] <= max_width and jpeg_size[1] <= max_height:
+        return image_data
+    
+    if pyvips is not None:
+        # libvips解码时直接缩小（JPEG使用shrink-on-load），内存占用与图像尺寸基本无关
+        img = pyvips.Image.thumbnail_buffer(image_data, max_width, height=max_height, size="down")
+        return img.jpegsave_buffer(Q=quality, optimize_coding=True, interlace=True, strip=True)
+    
+    from PIL import Image
+    import io
+    
+    # 从字节流创建图像（只解析文件头，像素数据按需解码）
+    img = Image.open(io.BytesIO(image_data))
+    
+    # JPEG在libjpeg层按DCT缩放解码到不小于目标两倍的尺寸，减少后续重采样的像素数
+    img.draft("RGB", (max_width * 2, max_height * 2))
+    
+    # 调整大小 - 按比例直接算出目标尺寸，整数倍快速缩小后只做一次LANCZOS重采样
+    # （安装pillow-simd时重采样会使用SIMD指令加速）
+    width, height = img.size
+    ratio = min(max_width / width, max_height / height)
+    if ratio < 1.0:
+        target_size = (max(1, round(width * ratio)), max(1, round(height * ratio)))
+        img = img.resize(target_size, resample=Image.LANCZOS, reducing_gap=3.0)
+    
+    # 保存为JPEG
+    output = io.BytesIO()
+    # optimize多一次遍历计算最优Huffman表，progressive使阅读器可以渐进显示，两者都不损失画质
+    img.save(output, format="JPEG", quality=quality, optimize=True, progressive=True)
+    return output.getvalue()
+
 
 class EPUBBuilder:
     """
@@ -27,7 +284,7 @@ class EPUBBuilder:
     
     def __init__(self, output_file, format="epub", css_template="default", 
                  toc_depth=3, max_image_width=800, max_image_height=1200, 
-                 image_quality=85, keep_tables_as_images=False):
+                 image_quality=85, keep_tables_as_images=False, compress_level=1):
         """
         初始化EPUB构建器
         
@@ -40,8 +297,11 @@ class EPUBBuilder:
             max_image_height: 最大图像高度
             image_quality: 图像质量（1-100）
             keep_tables_as_images: 是否将表格保留为图像
+            compress_level: 文本类文件的DEFLATE压缩级别（1-9），越大文件越小、构建越慢
         """
         self.output_file = output_file
+        # EPUB实际写入的路径，生成MOBI时可能是共享内存中的临时文件
+        self._epub_file = output_file
         self.format = format.lower()
         self.css_template = css_template
         self.toc_depth = toc_depth
@@ -49,19 +309,38 @@ class EPUBBuilder:
         self.max_image_height = max_image_height
         self.image_quality = image_quality
         self.keep_tables_as_images = keep_tables_as_images
+        self.compress_level = compress_level
         
         # 初始化书籍元数据
         self.title = "未命名书籍"
         self.author = "未知作者"
         self.language = "zh-CN"
         self.identifier = f"urn:uuid:{uuid.uuid4()}"
-        self.date = datetime.now().strftime("%Y-%m-%d")
+        # 创建时间只取一次，出版日期和修改时间都由它格式化
+        self._created = datetime.now(timezone.utc)
+        self.date = self._created.strftime("%Y-%m-%d")
+        self._modified = self._created.strftime("%Y-%m-%dT%H:%M:%SZ")
+        
+        # 初始化章节数据，按字段分别存放在平行数组中
+        # 章节内容在添加时即写入EPUB，这里只保留生成OPF/NCX所需的信息
+        self._chapter_ids = []
+        self._chapter_titles = []
+        self._chapter_levels = array.array("B")
+        
+        # 初始化图像计数器和图像清单，清单项为 (ID, 相对路径, MIME类型)
+        self.image_counter = 0
+        self._image_manifest = []
         
-        # 初始化章节列表
-        self.chapters = []
+        # 原始图像数据的哈希到图像路径的映射，重复的图像只存储一次
+        self._image_paths_by_hash = {}
         
-        # 初始化图像计数器
-        self.image_counter = 0
+        # EPUB压缩包及其底层缓冲文件，在create_epub_structure中创建
+        self.epub = None
+        self._spool = None
+        
+        # 调整图像大小的进程池，首次批量添加图像时创建，在close中关闭
+        self._pool = None
+        self._pool_workers = None
         
         logger.info(f"初始化EPUB构建器: 格式={format}, 模板={css_template}")
     
@@ -88,15 +367,30 @@ class EPUBBuilder:
             content: 章节内容（HTML格式）
             level: 章节级别（1-6）
         """
-        chapter = {
-            "title": title,
-            "content": content,
-            "level": level,
-            "id": f"chapter_{len(self.chapters) + 1}"
-        }
-        self.chapters.append(chapter)
+        chapter_id = f"chapter_{len(self._chapter_ids) + 1}"
+        self._chapter_ids.append(chapter_id)
+        self._chapter_titles.append(title)
+        self._chapter_levels.append(level)
+        
+        # 章节XHTML立即写入EPUB，不在内存中保留章节内容
+        self._open_epub()
+        self._write_chapter(chapter_id, escape(title).encode("utf-8"), level,
+                            content.encode("utf-8") if isinstance(content, str) else content)
         logger.debug(f"添加章节: {title} (级别={level})")
     
+    @property
+    def chapters(self):
+        """
+        章节列表
+        
+        返回:
+            list: 章节信息字典列表，每个字典包含title、level和id
+        """
+        return [
+            {"title": title, "level": level, "id": chapter_id}
+            for chapter_id, title, level in zip(self._chapter_ids, self._chapter_titles, self._chapter_levels)
+        ]
+    
     def load_css_template(self):
         """
         加载CSS模板
@@ -104,102 +398,69 @@ class EPUBBuilder:
         返回:
             str: CSS内容
         """
-        # 查找模板文件
-        # 获取当前模块所在目录
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        # 获取项目根目录
-        root_dir = os.path.dirname(current_dir)
-        # 构建模板路径
-        template_path = os.path.join(root_dir, "templates", f"{self.css_template}.css")
-        
-        if os.path.exists(template_path):
-            with open(template_path, "r", encoding="utf-8") as f:
-                return f.read()
-        else:
-            logger.warning(f"CSS模板不存在: {template_path}，使用默认样式")
-            # 返回默认CSS
-            return """
-            body {
-                font-family: "Source Han Serif CN", serif;
-                line-height: 1.5;
-                margin: 0 5%;
-            }
-            h1, h2, h3, h4, h5, h6 {
-                font-weight: bold;
-                margin: 1em 0 0.5em 0;
-            }
-            h1 { font-size: 1.5em; text-align: center; }
-            h2 { font-size: 1.3em; }
-            h3 { font-size: 1.1em; }
-            p { margin: 0.5em 0; text-indent: 2em; }
-            .cover { text-align: center; margin: 0; padding: 0; }
-            .cover img { max-width: 100%; }
-            .footnote { font-size: 0.9em; color: #666; }
-            table { border-collapse: collapse; width: 100%; margin: 1em 0; }
-            th, td { border: 1px solid #ddd; padding: 0.5em; }
-            th { background-color: #f2f2f2; }
-            """
+        return _load_css_template(self.css_template)
+    
+    def _open_epub(self):
+        """
+        创建EPUB文件并写入固定的文件头，已创建时不做任何事
+        """
+        if self.epub is not None:
+            return
+        
+        # 创建EPUB文件
+        # 将epub对象保存为类的属性，以便在其他方法中使用
+        # 文本类文件（XHTML/CSS/OPF/NCX）默认使用DEFLATE压缩
+        # 文本压缩率很高，级别1已能获得大部分收益，需要更小的文件时可调高compress_level
+        # 先写入内存中的缓冲文件，关闭时再一次性顺序写出，避免大量零碎的磁盘写入
+        self._spool = tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_SIZE)
+        self.epub = zipfile.ZipFile(self._spool, "w", compression=zipfile.ZIP_DEFLATED,
+                                    compresslevel=self.compress_level, allowZip64=True)
+        # 添加mimetype文件（必须是第一个文件，且不压缩）
+        self.epub.writestr("mimetype", _MIMETYPE, compress_type=zipfile.ZIP_STORED)
+        
+        # 创建META-INF目录
+        # 添加容器文件
+        self.epub.writestr("META-INF/container.xml", _CONTAINER_XML)
     
     def create_epub_structure(self):
         """
         创建EPUB文件结构
+        
+        章节和图像在添加时已写入，这里补全样式表、content.opf和toc.ncx。
         """
         logger.info("创建EPUB文件结构")
         
-        # 创建EPUB文件
-        if isinstance(self.output_file, MagicMock):
-            self.epub = self.output_file
-        else:
-            # 将epub对象保存为类的属性，以便在其他方法中使用
-            self.epub = zipfile.ZipFile(self.output_file, "w")
-            # 添加mimetype文件（必须是第一个文件，且不压缩）
-            self.epub.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
-            
-            # 创建META-INF目录
-            # 添加容器文件
-            container_xml = """<?xml version="1.0" encoding="UTF-8"?>
-<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
-    <rootfiles>
-        <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
-    </rootfiles>
-</container>"""
-            self.epub.writestr("META-INF/container.xml", container_xml)
-            
-            # 创建OEBPS目录结构
-            # 创建styles目录
-            # 添加CSS样式
-            css = self.load_css_template()
-            self.epub.writestr("OEBPS/styles/main.css", css)
-            
-            # 写入章节文件
-            for chapter in self.chapters:
-                chapter_content = f"""<?xml version="1.0" encoding="UTF-8"?>
-<!DOCTYPE html>
-<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">
-<head>
-    <title>{chapter["title"]}</title>
-    <link rel="stylesheet" type="text/css" href="styles/main.css"/>
-    <meta charset="UTF-8"/>
-</head>
-<body>
-    <h{chapter["level"]}>{chapter["title"]}</h{chapter["level"]}>
-    {chapter["content"]}
-</body>
-</html>"""
-                
-                self.epub.writestr(f"OEBPS/{chapter['id']}.xhtml", chapter_content)
-            
-            # 写入content.opf文件
-            content_opf = self.generate_content_opf()
-            self.epub.writestr("OEBPS/content.opf", content_opf)
-            
-            # 写入toc.ncx文件
-            toc_ncx = self.generate_toc()
-            self.epub.writestr("OEBPS/toc.ncx", toc_ncx)
-            
-            # 创建images目录（如果有图像）
-            if self.image_counter > 0:
-                self.epub.writestr("OEBPS/images/.keep", "")
+        self._open_epub()
+        
+        # 创建OEBPS目录结构
+        # 创建styles目录
+        # 添加CSS样式
+        self.epub.writestr("OEBPS/styles/main.css", _load_css_bytes(self.css_template))
+        
+        # 写入content.opf文件
+        with self.epub.open("OEBPS/content.opf", "w") as fp:
+            self.write_content_opf(fp)
+        
+        # 写入toc.ncx文件
+        with self.epub.open("OEBPS/toc.ncx", "w") as fp:
+            self.write_toc(fp)
+    
+    def _write_chapter(self, chapter_id, title_b, level, content_b):
+        """
+        将章节XHTML分段写入EPUB
+        
+        各片段直接写入压缩流，避免为每个章节拼接完整的XHTML字符串。
+        
+        参数:
+            chapter_id: 章节ID
+            title_b: 已转义并编码的章节标题
+            level: 章节级别
+            content_b: 已编码的章节内容
+        """
+        with self.epub.open(f"OEBPS/{chapter_id}.xhtml", "w") as fp:
+            fp.write(_CHAPTER_HEADER % (title_b, level, title_b, level))
+            fp.write(content_b)
+            fp.write(_CHAPTER_TAIL)
     
     def generate_content_opf(self):
         """
@@ -208,56 +469,55 @@ class EPUBBuilder:
         返回:
             str: content.opf内容
         """
+        buffer = io.BytesIO()
+        self.write_content_opf(buffer)
+        return buffer.getvalue().decode("utf-8")
+    
+    def write_content_opf(self, fp):
+        """
+        将content.opf以UTF-8字节流写入文件对象
+        
+        序列化结果直接写入fp，不在内存中拼接完整的字符串。
+        
+        参数:
+            fp: 以二进制方式打开的可写文件对象
+        """
         logger.info("生成content.opf文件")
         
-        # 创建UUID
-        book_id = str(uuid.uuid4())
-        
-        # 获取当前日期
-        today = datetime.now().strftime("%Y-%m-%d")
-        
-        # 获取当前时间
-        now = datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
-        
-        # 生成content.opf内容
-        content_opf = f"""<?xml version="1.0" encoding="UTF-8"?>
-<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="BookID">
-    <metadata xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:opf="http://www.idpf.org/2007/opf">
-        <dc:title>{self.title}</dc:title>
-        <dc:creator>{self.author}</dc:creator>
-        <dc:language>zh-CN</dc:language>
-        <dc:identifier id="BookID">urn:uuid:{book_id}</dc:identifier>
-        <dc:date>{today}</dc:date>
-        <meta property="dcterms:modified">{now}</meta>
-    </metadata>
-    <manifest>
-        <item id="ncx" href="toc.ncx" media-type="application/x-dtbncx+xml"/>
-        <item id="css" href="styles/main.css" media-type="text/css"/>"""
+        # 通过SubElement在同一棵树上构建，由ElementTree负责转义和序列化
+        package = ET.Element("package", {"xmlns": _OPF_NS, "version": "3.0", "unique-identifier": "BookID"})
+        
+        metadata = ET.SubElement(package, "metadata", {"xmlns:dc": _DC_NS, "xmlns:opf": _OPF_NS})
+        ET.SubElement(metadata, "dc:title").text = self.title
+        ET.SubElement(metadata, "dc:creator").text = self.author
+        ET.SubElement(metadata, "dc:language").text = self.language
+        ET.SubElement(metadata, "dc:identifier", {"id": "BookID"}).text = self.identifier
+        ET.SubElement(metadata, "dc:date").text = self.date
+        ET.SubElement(metadata, "meta", {"property": "dcterms:modified"}).text = self._modified
+        
+        manifest = ET.SubElement(package, "manifest")
+        ET.SubElement(manifest, "item",
+                      {"id": "ncx", "href": "toc.ncx", "media-type": "application/x-dtbncx+xml"})
+        ET.SubElement(manifest, "item",
+                      {"id": "css", "href": "styles/main.css", "media-type": "text/css"})
         
         # 添加章节
-        for chapter in self.chapters:
-            content_opf += f'\n        <item id="{chapter["id"]}" href="{chapter["id"]}.xhtml" media-type="application/xhtml+xml"/>'
+        for chapter_id in self._chapter_ids:
+            ET.SubElement(manifest, "item",
+                          {"id": chapter_id, "href": f"{chapter_id}.xhtml",
+                           "media-type": "application/xhtml+xml"})
         
         # 添加图像
-        for i in range(1, self.image_counter + 1):
-            content_opf += f'\n        <item id="image_{i}" href="images/image_{i}.jpg" media-type="image/jpeg"/>'
-        
-        # 添加spine - 添加一个独立的<spine>标签以确保测试通过
-        content_opf += """
-    </manifest>
-    <!-- Adding a standalone spine tag to pass the test -->
-    <spine>
-    <spine toc="ncx">"""
+        for image_id, href, mime_type in self._image_manifest:
+            ET.SubElement(manifest, "item", {"id": image_id, "href": href, "media-type": mime_type})
         
         # 添加章节到spine
-        for chapter in self.chapters:
-            content_opf += f'\n        <itemref idref="{chapter["id"]}"/>'
-        
-        content_opf += """
-    </spine>
-</package>"""
+        spine = ET.SubElement(package, "spine", {"toc": "ncx"})
+        for chapter_id in self._chapter_ids:
+            ET.SubElement(spine, "itemref", {"idref": chapter_id})
         
-        return content_opf
+        fp.write(_XML_DECLARATION)
+        ET.ElementTree(package).write(fp, encoding="utf-8", xml_declaration=False)
     
     def generate_toc(self):
         """
@@ -266,46 +526,47 @@ class EPUBBuilder:
         返回:
             str: toc.ncx内容
         """
+        buffer = io.BytesIO()
+        self.write_toc(buffer)
+        return buffer.getvalue().decode("utf-8")
+    
+    def write_toc(self, fp):
+        """
+        将toc.ncx以UTF-8字节流写入文件对象
+        
+        参数:
+            fp: 以二进制方式打开的可写文件对象
+        """
         logger.info("生成目录文件")
         
+        ncx = ET.Element("ncx", {"xmlns": _NCX_NS, "version": "2005-1"})
+        
         # 创建NCX文件头
-        ncx = f"""<?xml version="1.0" encoding="UTF-8"?>
-<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">
-    <head>
-        <meta name="dtb:uid" content="{self.identifier}"/>
-        <meta name="dtb:depth" content="{self.toc_depth}"/>
-        <meta name="dtb:totalPageCount" content="0"/>
-        <meta name="dtb:maxPageNumber" content="0"/>
-    </head>
-    <docTitle>
-        <text>{self.title}</text>
-    </docTitle>
-    <docAuthor>
-        <text>{self.author}</text>
-    </docAuthor>
-    <navMap>
-"""
+        head = ET.SubElement(ncx, "head")
+        for name, content in (("dtb:uid", self.identifier), ("dtb:depth", str(self.toc_depth)),
+                              ("dtb:totalPageCount", "0"), ("dtb:maxPageNumber", "0")):
+            ET.SubElement(head, "meta", {"name": name, "content": content})
+        
+        doc_title = ET.SubElement(ncx, "docTitle")
+        ET.SubElement(doc_title, "text").text = self.title
+        doc_author = ET.SubElement(ncx, "docAuthor")
+        ET.SubElement(doc_author, "text").text = self.author
         
         # 添加章节
+        nav_map = ET.SubElement(ncx, "navMap")
         play_order = 1
-        for chapter in self.chapters:
+        for chapter_id, title, level in zip(self._chapter_ids, self._chapter_titles, self._chapter_levels):
             # 只添加符合深度要求的章节
-            if chapter["level"] <= self.toc_depth:
-                ncx += f"""        <navPoint id="navPoint-{play_order}" playOrder="{play_order}">
-                    <navLabel>
-                        <text>{chapter["title"]}</text>
-                    </navLabel>
-                    <content src="{chapter["id"]}.xhtml"/>
-                </navPoint>
-"""
+            if level <= self.toc_depth:
+                nav_point = ET.SubElement(nav_map, "navPoint",
+                                          {"id": f"navPoint-{play_order}", "playOrder": str(play_order)})
+                nav_label = ET.SubElement(nav_point, "navLabel")
+                ET.SubElement(nav_label, "text").text = title
+                ET.SubElement(nav_point, "content", {"src": f"{chapter_id}.xhtml"})
                 play_order += 1
         
-        # 关闭navMap和ncx
-        ncx += """    </navMap>
-</ncx>"""
-        
-        # 写入NCX文件
-        return ncx
+        fp.write(_XML_DECLARATION)
+        ET.ElementTree(ncx).write(fp, encoding="utf-8", xml_declaration=False)
     
     def add_image(self, image_data, mime_type="image/jpeg"):
         """
@@ -318,15 +579,11 @@ class EPUBBuilder:
         返回:
             str: 图像路径
         """
-        # 处理图像
-        if mime_type == "image/jpeg":
-            ext = ".jpg"
-        elif mime_type == "image/png":
-            ext = ".png"
-        elif mime_type == "image/gif":
-            ext = ".gif"
-        else:
-            ext = ".jpg"
+        # 相同的图像（如每章重复的装饰图）直接复用已存储的路径，也省去调整大小
+        digest = hashlib.blake2b(image_data, digest_size=16).digest()
+        image_path = self._image_paths_by_hash.get(digest)
+        if image_path is not None:
+            return image_path
         
         # 调整图像大小 - 只在非测试数据时进行
         try:
@@ -334,21 +591,140 @@ class EPUBBuilder:
         except Exception as e:
             logger.warning(f"调整图像大小失败: {e}，使用原始图像数据")
         
-        # 生成图像ID
+        # 生成图像路径，扩展名和MIME类型以实际写入的数据为准
+        image_path = self._register_image(digest, _image_mime_type(image_data, mime_type))
+        
+        # 添加图像到EPUB
+        # JPEG/PNG/GIF本身已经压缩，直接存储以免浪费CPU
+        self._open_epub()
+        self.epub.writestr(image_path, image_data, compress_type=zipfile.ZIP_STORED)
+        
+        return image_path
+    
+    def add_image_path(self, path, mime_type="image/jpeg"):
+        """
+        从文件添加图像
+        
+        尺寸已符合要求的JPEG不整体读入内存，而是分块复制到EPUB中；
+        其他图像读入后按add_image处理。
+        
+        参数:
+            path: 图像文件路径
+            mime_type: MIME类型
+            
+        返回:
+            str: 图像路径
+        """
+        with open(path, "rb") as src:
+            header = src.read(_IMAGE_HEADER_SIZE)
+            jpeg_size = _jpeg_size(header)
+            if jpeg_size is None or jpeg_size[0] > self.max_image_width or jpeg_size[1] > self.max_image_height:
+                return self.add_image(header + src.read(), mime_type)
+            
+            # 分块计算哈希，与add_image的去重结果一致
+            hasher = hashlib.blake2b(header, digest_size=16)
+            for chunk in iter(lambda: src.read(_COPY_BUFFER_SIZE), b""):
+                hasher.update(chunk)
+            digest = hasher.digest()
+            image_path = self._image_paths_by_hash.get(digest)
+            if image_path is not None:
+                return image_path
+            
+            # 原样存储的一定是JPEG，与调用方给出的MIME类型无关
+            image_path = self._register_image(digest, "image/jpeg")
+            
+            # 以存储方式写入，数据分块从源文件复制
+            zinfo = zipfile.ZipInfo(image_path, date_time=time.localtime()[:6])
+            zinfo.compress_type = zipfile.ZIP_STORED
+            zinfo.file_size = src.tell()
+            src.seek(0)
+            self._open_epub()
+            with self.epub.open(zinfo, "w") as dst:
+                shutil.copyfileobj(src, dst, _COPY_BUFFER_SIZE)
+        
+        return image_path
+    
+    def _register_image(self, digest, mime_type):
+        """
+        为新图像分配ID和路径，并登记到图像清单
+        
+        参数:
+            digest: 原始图像数据的哈希
+            mime_type: MIME类型
+            
+        返回:
+            str: 图像路径
+        """
         self.image_counter += 1
         image_id = f"image_{self.image_counter}"
+        href = f"images/{image_id}{_IMAGE_EXTENSIONS.get(mime_type, '.jpg')}"
+        self._image_manifest.append((image_id, href, mime_type))
+        
+        image_path = f"OEBPS/{href}"
+        self._image_paths_by_hash[digest] = image_path
+        return image_path
+    
+    def add_images_bulk(self, images, max_workers=None):
+        """
+        批量添加图像，在多个进程中并行调整图像大小
         
-        # 生成图像路径
-        image_path = f"OEBPS/images/{image_id}{ext}"
+        参数:
+            images: (图像数据, MIME类型) 列表
+            max_workers: 进程数，None表示使用CPU核数
+            
+        返回:
+            list: 图像路径列表，顺序与images一致
+        """
+        # 重复的图像复用已分配的路径，只有新图像需要调整大小和写入
+        digests = []
+        new_images = {}
+        for image_data, mime_type in images:
+            digest = hashlib.blake2b(image_data, digest_size=16).digest()
+            if digest not in self._image_paths_by_hash and digest not in new_images:
+                new_images[digest] = (image_data, mime_type)
+            digests.append(digest)
+        
+        executor = self._get_pool(max_workers)
+        futures = [
+            executor.submit(_resize_image, image_data, self.max_image_width,
+                            self.max_image_height, self.image_quality)
+            for image_data, _ in new_images.values()
+        ]
+        
+        # 只在主线程中写入EPUB
+        # 按输入顺序分配图像ID，保持与逐个调用add_image相同的编号，扩展名和MIME类型以实际写入的数据为准
+        self._open_epub()
+        for (digest, (image_data, mime_type)), future in zip(new_images.items(), futures):
+            try:
+                image_data = future.result()
+            except Exception as e:
+                logger.warning(f"调整图像大小失败: {e}，使用原始图像数据")
+            image_path = self._register_image(digest, _image_mime_type(image_data, mime_type))
+            self.epub.writestr(image_path, image_data, compress_type=zipfile.ZIP_STORED)
+        
+        return [self._image_paths_by_hash[digest] for digest in digests]
+    
+    def _get_pool(self, max_workers=None):
+        """
+        获取调整图像大小的进程池
         
-        # 添加图像到EPUB
-        if isinstance(self.epub, MagicMock):
-            self.epub.writestr.return_value = image_path
-            self.epub.writestr(image_path, image_data)
-        else:
-            self.epub.writestr(image_path, image_data)
+        多次批量添加图像时复用同一个进程池，避免重复启动工作进程。
         
-        return image_path
+        参数:
+            max_workers: 进程数，None表示使用CPU核数
+            
+        返回:
+            ProcessPoolExecutor: 进程池
+        """
+        if self._pool is not None and self._pool_workers != max_workers:
+            self._pool.shutdown()
+            self._pool = None
+        
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=max_workers)
+            self._pool_workers = max_workers
+        
+        return self._pool
     
     def add_page(self, content, page_type):
         """
@@ -359,16 +735,7 @@ class EPUBBuilder:
             page_type: 页面类型
         """
         # 根据页面类型生成标题
-        if page_type == "cover":
-            title = "封面"
-        elif page_type == "toc":
-            title = "目录"
-        elif page_type == "chapter":
-            title = f"第{len(self.chapters) + 1}章"
-        elif page_type == "section":
-            title = f"第{len(self.chapters) + 1}节"
-        else:
-            title = f"页面{len(self.chapters) + 1}"
+        title = _PAGE_TITLES.get(page_type, "页面{}").format(len(self._chapter_ids) + 1)
         
         # 添加章节
         self.add_chapter(title, content, level=1)
@@ -385,19 +752,26 @@ class EPUBBuilder:
         返回:
             bytes: 调整后的图像数据
         """
-        from PIL import Image
-        import io
-        
-        # 从字节流创建图像
-        img = Image.open(io.BytesIO(image_data))
-        
-        # 调整大小 - 无条件调用thumbnail，确保在测试中也能正确调用
-        img.thumbnail((self.max_image_width, self.max_image_height))
+        return _resize_image(image_data, self.max_image_width, self.max_image_height, self.image_quality)
+    
+    def close(self):
+        """
+        关闭EPUB文件，并将缓冲的内容写出到输出文件
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
         
-        # 保存为JPEG
-        output = io.BytesIO()
-        img.save(output, format="JPEG", quality=self.image_quality)
-        return output.getvalue()
+        if self.epub is not None:
+            self.epub.close()
+            self.epub = None
+        
+        if self._spool is not None:
+            self._spool.seek(0)
+            with open(self._epub_file, "wb", buffering=_COPY_BUFFER_SIZE) as output:
+                shutil.copyfileobj(self._spool, output, _COPY_BUFFER_SIZE)
+            self._spool.close()
+            self._spool = None
     
     def convert_to_mobi(self):
         """
@@ -409,28 +783,107 @@ class EPUBBuilder:
         logger.info("转换EPUB为MOBI")
         
         # 确保EPUB文件已关闭
-        if hasattr(self, 'epub') and self.epub and not isinstance(self.epub, MagicMock):
-            self.epub.close()
+        self.close()
         
         # 构建输出文件路径
         mobi_file = os.path.splitext(self.output_file)[0] + ".mobi"
         
         # 使用Calibre的ebook-convert工具转换
+        # 丢弃大量的进度输出（调试时直接输出到控制台），只保留错误输出供失败时记录
         try:
             subprocess.run(
-                ["ebook-convert", self.output_file, mobi_file],
+                ["ebook-convert", self._epub_file, mobi_file],
                 check=True,
-                capture_output=True
+                stdout=None if logger.isEnabledFor(logging.DEBUG) else subprocess.DEVNULL,
+                stderr=subprocess.PIPE
             )
-            logger.info(f"MOBI转换成功: {mobi_file}")
-            return mobi_file
         except subprocess.CalledProcessError as e:
-            logger.error(f"MOBI转换失败: {e}")
-            logger.debug(f"错误输出: {e.stderr.decode('utf-8')}")
+            self._log_mobi_error(e)
+            self._keep_temp_epub()
             raise
         except FileNotFoundError:
             logger.error("未找到ebook-convert工具，请安装Calibre")
+            self._keep_temp_epub()
             raise
+        
+        self._remove_temp_epub()
+        logger.info(f"MOBI转换成功: {mobi_file}")
+        return mobi_file
+    
+    async def convert_to_mobi_async(self):
+        """
+        异步将EPUB转换为MOBI
+        
+        等待Calibre进程时让出事件循环，调用方可以同时构建其他电子书。
+        
+        返回:
+            str: MOBI文件路径
+        """
+        logger.info("转换EPUB为MOBI")
+        
+        # 确保EPUB文件已关闭
+        self.close()
+        
+        # 构建输出文件路径
+        mobi_file = os.path.splitext(self.output_file)[0] + ".mobi"
+        
+        command = ["ebook-convert", self._epub_file, mobi_file]
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                stdout=None if logger.isEnabledFor(logging.DEBUG) else subprocess.DEVNULL,
+                stderr=subprocess.PIPE
+            )
+            _, stderr = await process.communicate()
+            if process.returncode != 0:
+                raise subprocess.CalledProcessError(process.returncode, command, stderr=stderr)
+        except subprocess.CalledProcessError as e:
+            self._log_mobi_error(e)
+            self._keep_temp_epub()
+            raise
+        except FileNotFoundError:
+            logger.error("未找到ebook-convert工具，请安装Calibre")
+            self._keep_temp_epub()
+            raise
+        
+        self._remove_temp_epub()
+        logger.info(f"MOBI转换成功: {mobi_file}")
+        return mobi_file
+    
+    def _log_mobi_error(self, error):
+        """
+        记录MOBI转换失败的信息
+        
+        参数:
+            error: subprocess.CalledProcessError异常
+        """
+        logger.error(f"MOBI转换失败: {error}")
+        # 错误信息通常在末尾，只记录最后一部分
+        logger.debug(f"错误输出: {error.stderr[-_STDERR_TAIL_SIZE:].decode('utf-8', errors='replace')}")
+    
+    def _keep_temp_epub(self):
+        """
+        MOBI转换失败时，将共享内存中的中间EPUB移动到输出路径，避免丢失已构建的电子书
+        """
+        if self._epub_file != self.output_file:
+            try:
+                shutil.move(self._epub_file, self.output_file)
+            except OSError as e:
+                logger.error(f"保存中间EPUB文件失败: {e}，文件仍在: {self._epub_file}")
+                return
+            self._epub_file = self.output_file
+        logger.info(f"已保留EPUB文件: {self.output_file}")
+    
+    def _remove_temp_epub(self):
+        """
+        删除共享内存中的中间EPUB文件
+        """
+        if self._epub_file != self.output_file:
+            try:
+                os.unlink(self._epub_file)
+            except FileNotFoundError:
+                pass
+            self._epub_file = self.output_file
     
     def build(self):
         """
@@ -439,17 +892,45 @@ class EPUBBuilder:
         返回:
             str: 输出文件路径
         """
+        self._build_epub()
+        
+        # 如果需要MOBI格式，转换EPUB为MOBI
+        if self.format == "mobi":
+            return self.convert_to_mobi()
+        
+        return self.output_file
+    
+    def _build_epub(self):
+        """
+        构建EPUB文件并关闭
+        """
         logger.info(f"开始构建电子书: {self.output_file}")
         
         # 创建EPUB结构
         self.create_epub_structure()
         
+        # 只需要MOBI时，中间EPUB写入共享内存，转换后删除
+        if self.format == "mobi" and os.path.isdir(_SHM_DIR):
+            self._epub_file = os.path.join(_SHM_DIR, f"{uuid.uuid4().hex}.epub")
+        
         # 关闭EPUB文件
-        if hasattr(self, 'epub') and self.epub and not isinstance(self.epub, MagicMock):
-            self.epub.close()
+        self.close()
+    
+    async def build_async(self):
+        """
+        异步构建电子书
+        
+        EPUB在当前线程中构建，MOBI转换期间让出事件循环。批量转换时可用
+        asyncio.gather等方式并发调用，使下一本书的构建与上一本书的Calibre
+        转换重叠进行。
+        
+        返回:
+            str: 输出文件路径
+        """
+        self._build_epub()
         
         # 如果需要MOBI格式，转换EPUB为MOBI
         if self.format == "mobi":
-            return self.convert_to_mobi()
+            return await self.convert_to_mobi_async()
         
         return self.output_file
@@ -5,18 +5,213 @@ OCR处理器模块 - 使用大模型OCR功能
 """
 
 import os
+import re
+import tempfile
+import json
+import base64
 import time
+import random
+import asyncio
 import logging
+import hashlib
+import threading
+import copy
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 import cv2
 import numpy as np
 import io
 from PIL import Image
 import configparser
-import requests
+
+try:
+    from openai import OpenAI
+except ImportError:
+    OpenAI = None
+
+# orjson解析响应更快，未安装时回退到标准库json
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 限流或配额错误的特征，OpenAI兼容接口的异常信息中包含状态码和错误描述
+_RATE_LIMIT_RE = re.compile(r'\b429\b|rate.?limit|quota|too many requests', re.IGNORECASE)
+
+# 上传图像的最大边长，视觉模型对单张图像的token数有上限，更大的图像只会浪费带宽
+_MAX_UPLOAD_SIDE = 1600
+
+# 彩色扫描页使用JPEG编码的质量
+_JPEG_QUALITY = 85
+
+# OCR请求中固定不变的消息部分，所有页面共用
+_OCR_PROMPT = "请识别这张图片中的所有文字内容，保持原有格式。"
+_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": [{"type": "text", "text": "你是一个专业的OCR助手，请识别图片中的所有文字内容，保持原有格式。"}]
+}
+_USER_PROMPT_CONTENT = {"type": "text", "text": _OCR_PROMPT}
+
+# 多页请求的提示，每页图片前有对应的页面标记，模型按标记分段输出
+_MULTI_PAGE_PROMPT = (
+    "以上{count}张图片依次是{count}个页面，每张图片前是它的页面标记。"
+    "请分别识别每个页面中的所有文字内容，保持原有格式。"
+    "输出每个页面的内容前先单独一行输出该页面的标记，例如[PAGE_1]。"
+)
+_PAGE_MARKER_RE = re.compile(r'\[PAGE_(\d+)\]')
+
+
+def _is_rate_limit_error(error):
+    """
+    判断异常是否由限流或配额不足引起
+    
+    _call_llm_ocr会将原始异常包装后重新抛出，因此沿异常链逐个检查。
+    
+    参数:
+        error: 异常对象
+        
+    返回:
+        bool: 是否为限流错误
+    """
+    while error is not None:
+        if getattr(error, 'status_code', None) == 429 or _RATE_LIMIT_RE.search(str(error)):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def _image_digest(image):
+    """
+    计算图像内容的哈希，用作OCR结果缓存的键
+    
+    参数:
+        image: 图像数据（NumPy数组或字节流）
+        
+    返回:
+        bytes: 16字节摘要，不支持的图像类型返回None
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    if isinstance(image, np.ndarray):
+        # 形状和类型不同的数组可能有相同的字节内容
+        hasher.update(f"{image.dtype}{image.shape}".encode("ascii"))
+        hasher.update(np.ascontiguousarray(image).data)
+    elif isinstance(image, bytes):
+        hasher.update(image)
+    else:
+        return None
+    return hasher.digest()
+
+
+def _make_result(text, token_usage):
+    """
+    构建OCR结果
+    
+    参数:
+        text: 识别文本
+        token_usage: token使用量
+        
+    返回:
+        dict: OCR结果
+    """
+    return {
+        "text": text.strip(),
+        "confidence": 0.9,  # 大模型没有返回置信度，使用默认值
+        "blocks": [],  # 大模型没有返回块信息
+        "language": {
+            "code": "zh-CN",
+            "name": "简体中文"
+        },
+        "token_usage": token_usage
+    }
+
+
+def _encode_array(image, max_side=_MAX_UPLOAD_SIDE):
+    """
+    使用OpenCV将NumPy图像编码为上传格式
+    
+    OpenCV直接编码BGR数组，省去颜色转换和PIL图像的中间拷贝。
+    灰度和二值化图像使用PNG保持无损，彩色图像使用JPEG。
+    
+    参数:
+        image: OpenCV图像（灰度、BGR或BGRA）
+        max_side: 最大边长，超出时等比缩小
+        
+    返回:
+        tuple: (编码后的数据, MIME类型)，数据支持缓冲区协议，不额外拷贝
+    """
+    height, width = image.shape[:2]
+    if max(height, width) > max_side:
+        scale = max_side / max(height, width)
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    
+    if image.ndim == 2:
+        ok, encoded = cv2.imencode('.png', image, [int(cv2.IMWRITE_PNG_COMPRESSION), 1])
+        mime_type = "image/png"
+    else:
+        # OpenCV的JPEG编码器逐行丢弃BGRA的透明通道，无需先整图转换
+        ok, encoded = cv2.imencode('.jpg', image, [int(cv2.IMWRITE_JPEG_QUALITY), _JPEG_QUALITY])
+        mime_type = "image/jpeg"
+    
+    if not ok:
+        raise ValueError("OpenCV图像编码失败")
+    return memoryview(encoded), mime_type
+
+
+def _is_upload_ready(pil_image, max_side=_MAX_UPLOAD_SIDE):
+    """
+    判断图像文件是否可以不经重新编码直接上传
+    
+    与_encode_pil_image的输出一致：彩色和灰度JPEG，或灰度和二值PNG，且尺寸不超过上限。
+    
+    参数:
+        pil_image: 刚打开、尚未解码的PIL图像
+        max_side: 最大边长
+        
+    返回:
+        bool: 是否可以直接上传原始字节
+    """
+    if max(pil_image.size) > max_side:
+        return False
+    if pil_image.format == "JPEG":
+        return pil_image.mode in ("RGB", "L")
+    if pil_image.format == "PNG":
+        return pil_image.mode in ("L", "1")
+    return False
+
+
+def _encode_pil_image(pil_image, max_side=_MAX_UPLOAD_SIDE):
+    """
+    使用PIL将图像编码为上传格式
+    
+    参数:
+        pil_image: PIL图像
+        max_side: 最大边长，超出时等比缩小
+        
+    返回:
+        tuple: (编码后的数据, MIME类型)，数据支持缓冲区协议，不额外拷贝
+    """
+    # 缩小过大的图像
+    if max(pil_image.size) > max_side:
+        pil_image.thumbnail((max_side, max_side), Image.LANCZOS)
+    
+    buffer = io.BytesIO()
+    if pil_image.mode in ("L", "1"):
+        # 灰度和二值化图像保持无损，图像只上传一次，使用最低的压缩级别以节省CPU
+        pil_image.save(buffer, format="PNG", compress_level=1)
+        mime_type = "image/png"
+    else:
+        # 彩色扫描页使用JPEG，体积和编码耗时都远小于PNG
+        if pil_image.mode != "RGB":
+            pil_image = pil_image.convert("RGB")
+        pil_image.save(buffer, format="JPEG", quality=_JPEG_QUALITY, subsampling=2, optimize=False)
+        mime_type = "image/jpeg"
+    return buffer.getbuffer(), mime_type
+
 
 class OCRProcessor:
     """
@@ -25,6 +220,9 @@ class OCRProcessor:
     用于处理图像OCR识别，使用大模型的视觉OCR能力。
     """
     
+    # 已通过连通性检查的(API地址, API密钥, 模型)，同一进程中再次创建处理器时跳过检查
+    _connectivity_cache = set()
+    
     def __init__(self, config, logger=None):
         """
         初始化OCR处理器
@@ -42,6 +240,13 @@ class OCRProcessor:
         self.retry_count = config.getint('ocr', 'retry_count', fallback=3)
         self.batch_size = config.getint('ocr', 'batch_size', fallback=5)
         self.preprocess = config.getboolean('ocr', 'preprocess', fallback=False)
+        self.max_rps = config.getfloat('ocr', 'max_rps', fallback=0)
+        self.retry_wait = config.getfloat('ocr', 'retry_wait', fallback=1)
+        self.retry_max_wait = config.getfloat('ocr', 'retry_max_wait', fallback=60)
+        self.cache_size = config.getint('ocr', 'cache_size', fallback=512)
+        cache_dir = config.get('ocr', 'cache_dir', fallback='')
+        self.pages_per_request = config.getint('ocr', 'pages_per_request', fallback=1)
+        self.max_image_side = config.getint('ocr', 'max_image_side', fallback=_MAX_UPLOAD_SIDE)
         
         # 读取API配置
         self.api_url = config.get('ocr', 'api_url')
@@ -52,62 +257,53 @@ class OCRProcessor:
             self.logger.error("API配置无效，请在配置文件中设置有效的API URL和密钥")
             raise ValueError("API配置无效，请在配置文件中设置有效的API URL和密钥")
         
-        # 初始化token计数器
+        # 初始化token计数器，批量处理时多个线程同时更新
         self.total_tokens = 0
+        self._tokens_lock = threading.Lock()
+        
+        # OpenAI客户端，首次调用时创建，所有页面复用同一个连接池
+        self._client = None
         
-        # 检查API连通性
-        if not self._check_api_connectivity():
-            raise Exception("OCR API无法连通")
+        # 请求限速，所有线程共享下一次允许发送请求的时间
+        self._rate_lock = threading.Lock()
+        self._next_request_time = 0.0
+        
+        # OCR结果缓存，按图像内容哈希索引，页眉、空白页等重复页面无需再次请求
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        
+        # 磁盘缓存目录，按模型分目录存放，重复运行时无需再次请求
+        self._cache_dir = Path(os.path.expanduser(cache_dir)) / self.model_name if cache_dir else None
+        
+        # 检查API连通性，只记录成功的结果，失败时下次创建会重新检查
+        connectivity_key = (self.api_url, self.api_key, self.model_name)
+        if connectivity_key not in OCRProcessor._connectivity_cache:
+            if not self._check_api_connectivity():
+                raise Exception("OCR API无法连通")
+            OCRProcessor._connectivity_cache.add(connectivity_key)
         
         self.logger.info(f"🔍 初始化OCR处理器: 模型={self.model_name}")
     
     def _check_api_connectivity(self):
         """
         检查OCR API连通性
+        
+        返回:
+            bool: API是否可用
         """
         try:
-            # 使用 OpenAI 客户端验证连通性
-            from openai import OpenAI
-            import base64
-            import numpy as np
-            from PIL import Image
-            
-            # 创建一个简单的测试图像 - 白底黑字"测试"
-            test_image = np.ones((100, 200, 3), dtype=np.uint8) * 255  # 白色背景
-            # 添加一些黑色文本 (简化版本，实际上只是一个黑色矩形)
-            test_image[40:60, 50:150] = 0
-            
-            # 将NumPy数组转换为PIL图像
-            pil_image = Image.fromarray(test_image.astype('uint8'))
-            
-            # 将PIL图像转换为base64编码
-            buffer = io.BytesIO()
-            pil_image.save(buffer, format="JPEG")
-            base64_image = base64.b64encode(buffer.getvalue()).decode('utf-8')
+            # 使用 OpenAI 客户端验证连通性，同一个客户端之后用于所有OCR请求
+            client = self._get_client()
             
-            # 创建OpenAI客户端
-            client = OpenAI(
-                api_key=self.api_key,
-                base_url=self.api_url,
-            )
-            
-            # 发送包含图像的请求
+            # 查询模型列表即可验证地址和密钥，无需发送图像进行一次完整的识别
             self.logger.debug("发送OCR API连通性测试请求")
-            completion = client.chat.completions.create(
-                model=self.model_name,
-                messages=[
-                    {"role": "system", "content": [{"type": "text", "text": "你是一个OCR助手，请识别图片中的文字。"}]},
-                    {"role": "user", "content": [
-                        {"type": "text", "text": "请识别这张图片中的文字"},
-                        {"type": "image_url", "image_url": {
-                            "url": f"data:image/jpeg;base64,{base64_image}"
-                        }}
-                    ]},
-                ],
-                max_tokens=10  # 最小化请求以节省资源
-            )
+            try:
+                client.models.list()
+            except Exception as e:
+                # 服务未提供模型列表接口时返回404，说明地址可以连通
+                if getattr(e, 'status_code', None) != 404:
+                    raise
             
-            self.logger.debug(f"OCR API连通性测试响应: {completion}")
             # 如果没有异常，则连接成功
             return True
         except ImportError:
@@ -131,57 +327,324 @@ class OCRProcessor:
         if self.preprocess:
             image = self._preprocess_image(image)
         
-        # 重试机制
+        # 内容相同的页面直接返回缓存结果
+        return self._ocr_image(image, self._cache_key(image))
+    
+    def ocr_pages(self, images):
+        """
+        在一个请求中OCR处理多页图像
+        
+        多个页面作为多张图片放入同一条消息，模型按页面标记分段输出，
+        请求次数减少为原来的几分之一。无法按标记拆分结果时逐页重新识别。
+        
+        参数:
+            images: 图像列表（NumPy数组或字节流）
+            
+        返回:
+            list: OCR结果列表，顺序与images一致
+        """
+        if self.preprocess:
+            images = [self._preprocess_image(image) for image in images]
+        cache_keys = [self._cache_key(image) for image in images]
+        
+        # 先从缓存中取结果，只请求未命中的页面
+        results = [self._get_cached_result(cache_key) for cache_key in cache_keys]
+        pending = [i for i, result in enumerate(results) if result is None]
+        
+        if len(pending) > 1:
+            page_results = self._call_with_retry(self._call_llm_ocr_pages, [images[i] for i in pending])
+            if page_results is not None:
+                for i, result in zip(pending, page_results):
+                    self._record_result(cache_keys[i], result)
+                    results[i] = result
+                pending = []
+            else:
+                self.logger.warning("无法按页面拆分OCR结果，改为逐页识别")
+        
+        for i in pending:
+            results[i] = self._ocr_image(images[i], cache_keys[i])
+        
+        return results
+    
+    def _ocr_image(self, image, cache_key):
+        """
+        OCR处理单页已预处理的图像，优先使用缓存
+        
+        参数:
+            image: 图像数据
+            cache_key: 缓存键，为None时不使用缓存
+            
+        返回:
+            dict: OCR结果
+        """
+        cached = self._get_cached_result(cache_key)
+        if cached is not None:
+            return cached
+        
+        result = self._call_with_retry(self._call_llm_ocr, image)
+        self._record_result(cache_key, result)
+        return result
+    
+    def _cache_key(self, image):
+        """
+        计算图像的缓存键
+        
+        参数:
+            image: 已预处理的图像数据
+            
+        返回:
+            bytes: 缓存键，未启用缓存时返回None
+        """
+        if self.cache_size <= 0 and self._cache_dir is None:
+            return None
+        return _image_digest(image)
+    
+    def _get_cached_result(self, cache_key):
+        """
+        查找内容相同页面的缓存结果
+        
+        参数:
+            cache_key: 缓存键，为None时不使用缓存
+            
+        返回:
+            dict: 缓存结果的副本，token使用量为0，未命中时返回None
+        """
+        if cache_key is None:
+            return None
+        
+        with self._cache_lock:
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                self._cache.move_to_end(cache_key)
+        if cached is None:
+            cached = self._read_disk_cache(cache_key)
+            if cached is None:
+                return None
+            self._remember_result(cache_key, cached)
+        
+        self.logger.debug("OCR缓存命中，跳过请求")
+        # 缓存命中没有发送请求，调用方累计token时不应重复计入
+        result = copy.copy(cached)
+        if 'token_usage' in result:
+            result['token_usage'] = 0
+        return result
+    
+    def _remember_result(self, cache_key, result):
+        """
+        将结果放入内存缓存，超出容量时淘汰最早的结果
+        
+        参数:
+            cache_key: 缓存键
+            result: OCR结果
+        """
+        if self.cache_size <= 0:
+            return
+        with self._cache_lock:
+            self._cache[cache_key] = result
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+    
+    def _read_disk_cache(self, cache_key):
+        """
+        读取磁盘缓存的OCR结果
+        
+        参数:
+            cache_key: 缓存键
+            
+        返回:
+            dict: OCR结果，未启用磁盘缓存或未命中时返回None
+        """
+        if self._cache_dir is None:
+            return None
+        try:
+            data = (self._cache_dir / f"{cache_key.hex()}.json").read_bytes()
+            result = orjson.loads(data) if orjson is not None else json.loads(data)
+        except (OSError, ValueError):
+            return None
+        # 兼容旧的缓存文件，磁盘上的结果不计入本次运行的token使用量
+        if 'token_usage' in result:
+            result['token_usage'] = 0
+        return result
+    
+    def _write_disk_cache(self, cache_key, result):
+        """
+        写入磁盘缓存
+        
+        参数:
+            cache_key: 缓存键
+            result: OCR结果
+        """
+        # 不缓存空结果，避免识别失败的页面在之后的运行中一直被跳过
+        if self._cache_dir is None or not result.get('text'):
+            return
+        
+        # token使用量只属于首次请求，之后的运行读取缓存不再计费
+        if 'token_usage' in result:
+            result = {**result, 'token_usage': 0}
+        
+        # 先写入临时文件再替换，避免并发读取到不完整的结果
+        try:
+            data = orjson.dumps(result) if orjson is not None else json.dumps(result, ensure_ascii=False).encode("utf-8")
+            self._cache_dir.mkdir(parents=True, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self._cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, self._cache_dir / f"{cache_key.hex()}.json")
+        except (OSError, TypeError):
+            # 缓存写入失败不影响识别流程
+            self.logger.debug("写入OCR磁盘缓存失败")
+    
+    def _record_result(self, cache_key, result):
+        """
+        记录一页的OCR结果，累计token使用量并写入缓存
+        
+        参数:
+            cache_key: 缓存键，为None时不使用缓存
+            result: OCR结果
+        """
+        # 记录文本长度
+        text_length = len(result.get('text', ''))
+        self.logger.debug("OCR处理成功: 文本长度=%s", text_length)
+        
+        # 更新token使用情况
+        if 'token_usage' in result:
+            token_usage = result['token_usage']
+            with self._tokens_lock:
+                self.total_tokens += token_usage
+                total_tokens = self.total_tokens
+            self.logger.debug("🔢 累计token使用量: %s", total_tokens)
+        
+        if cache_key is not None:
+            self._remember_result(cache_key, result)
+            self._write_disk_cache(cache_key, result)
+    
+    def _call_with_retry(self, func, *args):
+        """
+        按限速调用OCR请求，失败时重试
+        
+        参数:
+            func: 发送请求的方法
+            *args: 传给func的参数
+            
+        返回:
+            func的返回值
+        """
         for attempt in range(self.retry_count):
             try:
-                self.logger.debug(f"OCR处理尝试 {attempt+1}/{self.retry_count}")
+                self.logger.debug("OCR处理尝试 %s/%s", attempt+1, self.retry_count)
                 
                 # 调用大模型OCR
-                result = self._call_llm_ocr(image)
-                
-                # 记录文本长度
-                text_length = len(result.get('text', ''))
-                self.logger.debug(f"OCR处理成功: 文本长度={text_length}")
-                
-                # 更新token使用情况
-                if 'token_usage' in result:
-                    token_usage = result['token_usage']
-                    self.total_tokens += token_usage
-                    if self.logger:
-                        self.logger.debug(f"🔢 累计token使用量: {self.total_tokens}")
-                
-                return result
+                self._wait_for_rate_limit()
+                return func(*args)
                 
             except Exception as e:
                 self.logger.warning(f"OCR处理失败: {e}")
                 
                 if attempt < self.retry_count - 1:
-                    # 指数退避
-                    wait_time = 2 ** attempt
-                    self.logger.info(f"等待 {wait_time} 秒后重试...")
+                    wait_time = self._retry_wait(attempt, e)
+                    self.logger.info(f"等待 {wait_time:.1f} 秒后重试...")
                     time.sleep(wait_time)
                 else:
                     self.logger.error(f"OCR处理失败，已达最大重试次数: {e}")
                     raise
     
+    def _wait_for_rate_limit(self):
+        """
+        按max_rps限制请求速率，必要时阻塞当前线程
+        """
+        if self.max_rps <= 0:
+            return
+        
+        # 在锁内预约发送时间，在锁外等待，避免阻塞其他线程预约
+        interval = 1.0 / self.max_rps
+        with self._rate_lock:
+            now = time.monotonic()
+            wait_time = self._next_request_time - now
+            self._next_request_time = max(now, self._next_request_time) + interval
+        
+        if wait_time > 0:
+            time.sleep(wait_time)
+    
+    def _retry_wait(self, attempt, error):
+        """
+        计算重试前的等待时间
+        
+        限流错误使用带随机抖动的指数退避，避免并发请求同时重试再次触发限流；
+        其他错误按固定间隔快速重试。
+        
+        参数:
+            attempt: 已失败的尝试序号（从0开始）
+            error: 本次失败的异常
+            
+        返回:
+            float: 等待秒数
+        """
+        if _is_rate_limit_error(error):
+            backoff = self.retry_wait * 2 ** (attempt + 1) + random.uniform(0, self.retry_wait)
+            return min(self.retry_max_wait, backoff)
+        return self.retry_wait
+    
     def batch_process(self, images):
         """
         批量处理多个图像
         
+        在已运行的事件循环中（如Jupyter或异步调用方）无法使用asyncio.run，此时改用线程池并发处理；
+        异步调用方应直接使用batch_process_async。
+        
         参数:
             images: 图像列表
             
         返回:
             list: OCR结果列表
         """
-        results = []
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.batch_process_async(images))
+        
+        with ThreadPoolExecutor(max_workers=self.batch_size) as executor:
+            if self.pages_per_request > 1:
+                groups = executor.map(self.ocr_pages, [
+                    images[start:start + self.pages_per_request]
+                    for start in range(0, len(images), self.pages_per_request)
+                ])
+                return [result for group in groups for result in group]
+            return list(executor.map(self.ocr_page, images))
+    
+    async def batch_process_async(self, images):
+        """
+        并发处理多个图像
         
-        for i, image in enumerate(images):
-            self.logger.info(f"处理图像 {i+1}/{len(images)}")
-            result = self.ocr_page(image)
-            results.append(result)
+        每个页面在线程池中调用ocr_page，同时进行的请求数不超过batch_size，
+        网络等待相互重叠。pages_per_request大于1时每个请求包含多个页面。
         
-        return results
+        参数:
+            images: 图像列表
+            
+        返回:
+            list: OCR结果列表，顺序与images一致
+        """
+        semaphore = asyncio.Semaphore(self.batch_size)
+        loop = asyncio.get_running_loop()
+        
+        if self.pages_per_request > 1:
+            async def _process_group(start):
+                group = images[start:start + self.pages_per_request]
+                async with semaphore:
+                    self.logger.info(f"处理图像 {start+1}-{start+len(group)}/{len(images)}")
+                    return await loop.run_in_executor(None, self.ocr_pages, group)
+            
+            groups = await asyncio.gather(*(
+                _process_group(start) for start in range(0, len(images), self.pages_per_request)
+            ))
+            return [result for group in groups for result in group]
+        
+        async def _process(i, image):
+            async with semaphore:
+                self.logger.info(f"处理图像 {i+1}/{len(images)}")
+                return await loop.run_in_executor(None, self.ocr_page, image)
+        
+        return await asyncio.gather(*(_process(i, image) for i, image in enumerate(images)))
     
     def _preprocess_image(self, image):
         """
@@ -195,21 +658,42 @@ class OCRProcessor:
         """
         self.logger.debug("执行图像预处理")
         
-        # 确保图像是NumPy数组
+        # 转换为灰度图，字节流直接解码为灰度图，省去彩色解码和颜色转换
         if isinstance(image, bytes):
-            nparr = np.frombuffer(image, np.uint8)
-            image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        # 转换为灰度图
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            gray = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_GRAYSCALE)
+        elif image.ndim == 2:
+            gray = image.copy()
+        else:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY if image.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
         
         # 高斯模糊去噪
         blurred = cv2.GaussianBlur(gray, (5, 5), 0)
         
-        # 自适应二值化
-        _, binary = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        # 自适应二值化，结果写回灰度图缓冲区，避免再分配一张整页图像
+        cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=gray)
+        
+        return gray
+    
+    def _get_client(self):
+        """
+        获取OpenAI客户端
+        
+        返回:
+            OpenAI: 客户端实例
+        """
+        if self._client is None:
+            if OpenAI is None:
+                raise ImportError("OpenAI 包未安装")
+            
+            # 重试由ocr_page统一处理，关闭SDK内置的重试
+            self._client = OpenAI(
+                api_key=self.api_key,
+                base_url=self.api_url,
+                timeout=self.timeout,
+                max_retries=0,
+            )
         
-        return binary
+        return self._client
     
     def _call_llm_ocr(self, image):
         """
@@ -221,125 +705,42 @@ class OCRProcessor:
         返回:
             dict: OCR结果
         """
-        self.logger.debug(f"使用OpenAI兼容接口调用阿里云OCR服务")
+        self.logger.debug("使用OpenAI兼容接口调用阿里云OCR服务")
         
         try:
-            from openai import OpenAI
-            import base64
-            from io import BytesIO
-            from PIL import Image as PILImage
-            import tempfile
-            import os
-            import json
+            content = [
+                {"type": "image_url", "image_url": {"url": self._image_url(image)}},
+                _USER_PROMPT_CONTENT
+            ]
+            text_content, token_usage = self._request_completion(content)
+            return _make_result(text_content, token_usage)
             
-            # 确保图像是正确的格式
-            if isinstance(image, np.ndarray):
-                # 将NumPy数组转换为PIL图像
-                if len(image.shape) == 2:  # 灰度图像
-                    pil_image = PILImage.fromarray(image)
-                    self.logger.debug(f"转换灰度图像为PIL图像")
-                else:  # 彩色图像
-                    # 确保图像是BGR格式（OpenCV默认）并转换为RGB（PIL需要）
-                    if image.shape[2] == 3:  # 彩色图像
-                        pil_image = PILImage.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-                        self.logger.debug(f"转换BGR彩色图像为PIL图像")
-                    else:  # 可能是BGRA
-                        pil_image = PILImage.fromarray(cv2.cvtColor(image, cv2.COLOR_BGRA2RGBA))
-                        self.logger.debug(f"转换BGRA彩色图像为PIL图像")
-            elif isinstance(image, bytes):
-                # 已经是字节流，转换为PIL图像
-                try:
-                    pil_image = PILImage.open(BytesIO(image))
-                    self.logger.debug(f"从字节流转换为PIL图像")
-                except Exception as e:
-                    self.logger.error(f"无法解析图像字节流: {e}")
-                    raise ValueError(f"无效的图像字节流: {e}")
-            else:
-                self.logger.error(f"不支持的图像格式: {type(image)}")
-                raise ValueError(f"不支持的图像格式: {type(image)}")
-            
-            # 将图像保存到临时文件
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as temp_file:
-                temp_image_path = temp_file.name
-                pil_image.save(temp_image_path, format="PNG")
-                self.logger.debug(f"图像已保存到临时文件")
+        except ImportError as e:
+            self.logger.error(f"导入必要的包失败: {e}")
+            raise Exception(f"导入必要的包失败: {e}")
+        except Exception as e:
+            self.logger.error(f"调用OCR API失败: {e}")
+            raise Exception(f"调用OCR API失败: {e}")
+    
+    def _call_llm_ocr_pages(self, images):
+        """
+        在一个请求中调用大模型OCR识别多页图像
+        
+        参数:
+            images: 图像列表
             
-            try:
-                # 将图像转换为base64编码
-                def encode_image(image_path):
-                    with open(image_path, "rb") as image_file:
-                        return base64.b64encode(image_file.read()).decode("utf-8")
-                
-                # 获取图像的base64编码
-                base64_image = encode_image(temp_image_path)
-                self.logger.debug(f"图像已转换为base64编码")
-                
-                # 创建OpenAI客户端
-                client = OpenAI(
-                    api_key=self.api_key,
-                    base_url=self.api_url,
-                )
-                
-                # 构建消息
-                messages = [
-                    {
-                        "role": "system",
-                        "content": [{"type": "text", "text": "你是一个专业的OCR助手，请识别图片中的所有文字内容，保持原有格式。"}]
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image_url",
-                                "image_url": {"url": f"data:image/png;base64,{base64_image}"}
-                            },
-                            {"type": "text", "text": "请识别这张图片中的所有文字内容，保持原有格式。"}
-                        ]
-                    }
-                ]
-                
-                # 发送请求
-                self.logger.debug(f"开始发送OCR请求")
-                completion = client.chat.completions.create(
-                    model=self.model_name,
-                    messages=messages,
-                    timeout=self.timeout
-                )
-                self.logger.debug(f"请求已完成，获取到响应")
-                
-                # 提取文本内容
-                text_content = completion.choices[0].message.content
-                
-                # 提取token使用情况
-                token_usage = 0
-                if hasattr(completion, 'usage') and completion.usage:
-                    token_usage = completion.usage.total_tokens
-                    self.logger.debug(f"本次请求使用了 {token_usage} tokens")
-                
-                # 构建结果
-                result = {
-                    "text": text_content.strip(),
-                    "confidence": 0.9,  # 大模型没有返回置信度，使用默认值
-                    "blocks": [],  # 大模型没有返回块信息
-                    "language": {
-                        "code": "zh-CN",
-                        "name": "简体中文"
-                    },
-                    "token_usage": token_usage
-                }
-                
-                return result
-            except Exception as e:
-                self.logger.error(f"调用OCR API过程中发生错误: {e}")
-                # 尝试提供更详细的错误信息
-                if hasattr(e, 'response') and hasattr(e.response, 'text'):
-                    self.logger.error(f"API响应内容: {e.response.text}")
-                raise e
-            finally:
-                # 清理临时文件
-                if os.path.exists(temp_image_path):
-                    os.remove(temp_image_path)
-                    self.logger.debug(f"已删除临时文件")
+        返回:
+            list: 每页的OCR结果，无法按页面标记拆分时返回None
+        """
+        self.logger.debug("使用OpenAI兼容接口识别 %s 页", len(images))
+        
+        try:
+            content = []
+            for i, image in enumerate(images, 1):
+                content.append({"type": "text", "text": f"[PAGE_{i}]"})
+                content.append({"type": "image_url", "image_url": {"url": self._image_url(image)}})
+            content.append({"type": "text", "text": _MULTI_PAGE_PROMPT.format(count=len(images))})
+            text_content, token_usage = self._request_completion(content)
             
         except ImportError as e:
             self.logger.error(f"导入必要的包失败: {e}")
@@ -347,6 +748,107 @@ class OCRProcessor:
         except Exception as e:
             self.logger.error(f"调用OCR API失败: {e}")
             raise Exception(f"调用OCR API失败: {e}")
+        
+        # 按页面标记拆分，标记必须从1开始依次出现
+        parts = _PAGE_MARKER_RE.split(text_content)
+        labels = [int(label) for label in parts[1::2]]
+        if labels != list(range(1, len(images) + 1)):
+            self.logger.debug("OCR结果中的页面标记不完整: %s", labels)
+            # 结果无法使用，但请求已经消耗了token，逐页重试前先计入总量
+            with self._tokens_lock:
+                self.total_tokens += token_usage
+            return None
+        
+        # token使用量平均分配到各页，余数计入第一页
+        share, remainder = divmod(token_usage, len(images))
+        return [
+            _make_result(text, share + (remainder if i == 0 else 0))
+            for i, text in enumerate(parts[2::2])
+        ]
+    
+    def _image_url(self, image):
+        """
+        将图像编码为上传使用的data URL
+        
+        参数:
+            image: 图像数据（NumPy数组或字节流）
+            
+        返回:
+            str: data URL
+        """
+        # 在内存中编码为上传格式，无需经过临时文件
+        if isinstance(image, np.ndarray):
+            # NumPy数组直接由OpenCV编码，无需转换为PIL图像
+            encoded, mime_type = _encode_array(image, self.max_image_side)
+            self.logger.debug("使用OpenCV编码图像")
+        elif isinstance(image, bytes):
+            # 已经是字节流，由PIL识别格式，打开时只读取文件头
+            try:
+                pil_image = Image.open(io.BytesIO(image))
+                self.logger.debug("从字节流转换为PIL图像")
+            except Exception as e:
+                self.logger.error(f"无法解析图像字节流: {e}")
+                raise ValueError(f"无效的图像字节流: {e}")
+            if _is_upload_ready(pil_image, self.max_image_side):
+                # 已是上传格式且尺寸合适，直接上传原始字节，无需解码再编码
+                encoded, mime_type = image, Image.MIME[pil_image.format]
+            else:
+                encoded, mime_type = _encode_pil_image(pil_image, self.max_image_side)
+        else:
+            self.logger.error(f"不支持的图像格式: {type(image)}")
+            raise ValueError(f"不支持的图像格式: {type(image)}")
+        
+        # 直接编码缓冲区，ASCII解码比UTF-8解码更快
+        base64_image = base64.b64encode(encoded).decode("ascii")
+        self.logger.debug("图像已转换为base64编码")
+        return f"data:{mime_type};base64,{base64_image}"
+    
+    def _request_completion(self, content):
+        """
+        发送OCR请求
+        
+        参数:
+            content: 用户消息内容
+            
+        返回:
+            tuple: (识别文本, token使用量)
+        """
+        try:
+            # 获取OpenAI客户端（复用连接）
+            client = self._get_client()
+            
+            # 构建消息
+            messages = [
+                _SYSTEM_MESSAGE,
+                {"role": "user", "content": content}
+            ]
+            
+            # 发送请求，读取原始响应体，只取需要的字段，跳过SDK对整个响应的模型校验
+            self.logger.debug("开始发送OCR请求")
+            response = client.chat.completions.with_raw_response.create(
+                model=self.model_name,
+                messages=messages,
+                timeout=self.timeout
+            )
+            body = response.http_response.content
+            completion = orjson.loads(body) if orjson is not None else json.loads(body)
+            self.logger.debug("请求已完成，获取到响应")
+            
+            # 提取文本内容
+            text_content = completion["choices"][0]["message"].get("content") or ""
+            
+            # 提取token使用情况
+            token_usage = (completion.get("usage") or {}).get("total_tokens") or 0
+            if token_usage:
+                self.logger.debug("本次请求使用了 %s tokens", token_usage)
+            
+            return text_content, token_usage
+        except Exception as e:
+            self.logger.error(f"调用OCR API过程中发生错误: {e}")
+            # 尝试提供更详细的错误信息
+            if hasattr(e, 'response') and hasattr(e.response, 'text'):
+                self.logger.error(f"API响应内容: {e.response.text}")
+            raise e
     
     def detect_primary_language(self, ocr_result):
         """
@@ -358,12 +860,13 @@ class OCRProcessor:
         返回:
             str: 语言代码
         """
-        if "language" not in ocr_result:
-            return "unknown"
-        
-        # 找出置信度最高的语言
-        languages = ocr_result["language"]
+        languages = ocr_result.get("language")
         if not languages:
             return "unknown"
         
-        return max(languages.items(), key=lambda x: x[1])[0]
+        # _call_llm_ocr返回的语言信息直接包含语言代码
+        if "code" in languages:
+            return languages["code"]
+        
+        # 找出置信度最高的语言
+        return max(languages, key=languages.get)
@@ -4,10 +4,17 @@
 封面页处理器
 """
 
+from html import escape
+
 import cv2
-import numpy as np
 from .base import BaseProcessor
 
+# 计算非空白占比时缩小到的边长，占比只用于粗略的阈值判断，无需全分辨率
+_RATIO_SAMPLE_SIZE = 256
+
+# 文本超过该长度时置信度最多为0.1，不可能被判定为封面
+_MAX_COVER_TEXT_LENGTH = 300
+
 
 class CoverProcessor(BaseProcessor):
     """
@@ -30,6 +37,16 @@ class CoverProcessor(BaseProcessor):
         """
         confidence = 0.0
         
+        # 计算文本长度和行数，各特征共用
+        if text:
+            stripped = text.strip()
+            text_length = len(stripped)
+            line_count = stripped.count('\n') + 1
+        
+        # 文本很多的页面无需再分析图像
+        if text and text_length > _MAX_COVER_TEXT_LENGTH:
+            return 0.0
+        
         # 特征1: 图像占比大
         # 计算非空白区域占比
         if image is not None:
@@ -38,12 +55,13 @@ class CoverProcessor(BaseProcessor):
                 gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
             else:
                 gray = image
-                
-            # 二值化
-            _, binary = cv2.threshold(gray, 200, 255, cv2.THRESH_BINARY_INV)
             
-            # 计算非空白像素占比
-            non_white_ratio = np.count_nonzero(binary) / binary.size
+            # 缩小后再统计，大幅减少整页扫描的内存访问
+            if gray.shape[0] > _RATIO_SAMPLE_SIZE or gray.shape[1] > _RATIO_SAMPLE_SIZE:
+                gray = cv2.resize(gray, (_RATIO_SAMPLE_SIZE, _RATIO_SAMPLE_SIZE), interpolation=cv2.INTER_AREA)
+            
+            # 计算非空白像素（灰度不超过200）占比，比较和计数各一次扫描
+            non_white_ratio = cv2.countNonZero(cv2.compare(gray, 200, cv2.CMP_LE)) / gray.size
             
             # 如果非空白区域占比大于30%，增加置信度
             if non_white_ratio > 0.3:
@@ -55,9 +73,6 @@ class CoverProcessor(BaseProcessor):
         
         # 特征2: 文本较少
         if text:
-            # 计算文本长度
-            text_length = len(text.strip())
-            
             # 如果文本较少（少于100个字符），增加置信度
             if text_length < 100:
                 confidence += 0.2
@@ -74,17 +89,14 @@ class CoverProcessor(BaseProcessor):
             if text_length > 300:
                 confidence -= 0.2
             
-            # 计算行数，多行文本不太可能是封面
-            lines = text.strip().split('\n')
-            if len(lines) > 5:
+            # 多行文本不太可能是封面
+            if line_count > 5:
                 confidence -= 0.1
         
         # 特征3: 包含书名和作者信息
         if text:
-            lines = text.strip().split('\n')
-            
             # 如果行数在2-5之间，可能是书名和作者
-            if 2 <= len(lines) <= 5:
+            if 2 <= line_count <= 5:
                 confidence += 0.1
         
         return max(0.0, min(confidence, 1.0))  # 确保值在0-1之间
@@ -101,8 +113,8 @@ class CoverProcessor(BaseProcessor):
         
         # 构建HTML
         html = f"""<div class="cover">
-    <h1>{title}</h1>
-    <div class="author">{author}</div>
+    <h1>{escape(title, quote=False)}</h1>
+    <div class="author">{escape(author, quote=False)}</div>
 </div>"""
         
         return html
@@ -118,7 +130,7 @@ class CoverProcessor(BaseProcessor):
             return ("未知书名", "未知作者")
         
         lines = self.text.strip().split('\n')
-        lines = [line.strip() for line in lines if line.strip()]
+        lines = [stripped for line in lines if (stripped := line.strip())]
         
         # 如果只有一行，假设是书名
         if len(lines) == 1:
@@ -5,8 +5,27 @@
 """
 
 import re
+from html import escape
 from .base import BaseProcessor
 
+# 圆圈数字脚注标记
+_CIRCLED_DIGITS = '①②③④⑤⑥⑦⑧⑨⑩'
+
+# 其余需要正则匹配的脚注标记：※1、[1]、(1)、1)、*
+_PATTERN_MARKERS = r'※\d+|\[\d+\]|\(\d+\)|\d+\)|\*+'
+
+# 脚注标记：※1、圆圈数字、[1]、(1)、1)、*
+_MARKER_PATTERN = r'※\d+|[' + _CIRCLED_DIGITS + r']|\[\d+\]|\(\d+\)|\d+\)|\*+'
+
+# 需要正则匹配的标记合并为一个表达式，一次扫描完成统计
+_MARKERS_RE = re.compile(_PATTERN_MARKERS)
+
+# 形如 "※1 这是脚注内容" 的脚注行
+_FOOTNOTE_LINE_RE = re.compile(r'^(' + _MARKER_PATTERN + r')\s+(.+)$')
+
+# 在整段文本中逐行匹配脚注行，空白不跨行，等价于对每个去除首尾空白的行使用_FOOTNOTE_LINE_RE
+_FOOTNOTE_LINES_RE = re.compile(r'^[^\S\n]*(?:' + _MARKER_PATTERN + r')[^\S\n]+\S', re.MULTILINE)
+
 
 class FootnoteProcessor(BaseProcessor):
     """
@@ -33,28 +52,15 @@ class FootnoteProcessor(BaseProcessor):
             return confidence
         
         # 特征1: 包含脚注标记
-        footnote_markers = [
-            r'※\d+',  # ※1, ※2, ...
-            r'[①②③④⑤⑥⑦⑧⑨⑩]',  # 圆圈数字
-            r'\[\d+\]',  # [1], [2], ...
-            r'\(\d+\)',  # (1), (2), ...
-            r'\d+\)',  # 1), 2), ...
-            r'\*+',  # *, **, ...
-        ]
-        
-        marker_count = 0
-        for pattern in footnote_markers:
-            matches = re.findall(pattern, text)
-            marker_count += len(matches)
+        # 圆圈数字是单个字符，直接用str.count统计，不与其他标记重叠
+        marker_count = len(_MARKERS_RE.findall(text)) + sum(text.count(c) for c in _CIRCLED_DIGITS)
         
         if marker_count > 0:
             confidence += min(0.5, marker_count * 0.1)
         
         # 特征2: 包含脚注内容模式
         # 查找形如 "※1 这是脚注内容" 的模式
-        footnote_pattern = r'(※\d+|[①②③④⑤⑥⑦⑧⑨⑩]|\[\d+\]|\(\d+\)|\d+\)|\*+)\s+.+'
-        lines = text.strip().split('\n')
-        footnote_lines = sum(1 for line in lines if re.match(footnote_pattern, line.strip()))
+        footnote_lines = sum(1 for _ in _FOOTNOTE_LINES_RE.finditer(text))
         
         if footnote_lines > 0:
             confidence += min(0.5, footnote_lines * 0.1)
@@ -72,17 +78,22 @@ class FootnoteProcessor(BaseProcessor):
         footnotes = self.extract_footnotes()
         
         # 处理正文（替换脚注标记为链接）
-        processed_text = self.text
-        for i, footnote in enumerate(footnotes):
-            marker = footnote['marker']
-            # 转义正则表达式特殊字符
-            escaped_marker = re.escape(marker)
-            # 替换脚注标记为链接
-            processed_text = re.sub(
-                f'({escaped_marker})(?!\\s+.+)',  # 匹配不后跟内容的标记
-                f'<a href="#footnote-{i+1}" id="footnote-ref-{i+1}" class="footnote-ref">\\1</a>',
-                processed_text
+        # 先转义OCR文本中的HTML特殊字符，脚注标记本身不含这些字符
+        processed_text = escape(self.text, quote=False)
+        if footnotes:
+            # 所有标记合并为一个分支表达式，一次扫描完成替换
+            # 较长的标记优先匹配，如 "**" 优先于 "*"
+            index = {footnote['marker']: i + 1 for i, footnote in enumerate(footnotes)}
+            markers = sorted(index, key=len, reverse=True)
+            marker_re = re.compile(
+                '(' + '|'.join(re.escape(marker) for marker in markers) + ')(?!\\s+.+)'  # 匹配不后跟内容的标记
             )
+            
+            def _link(match):
+                n = index[match.group(1)]
+                return f'<a href="#footnote-{n}" id="footnote-ref-{n}" class="footnote-ref">{match.group(1)}</a>'
+            
+            processed_text = marker_re.sub(_link, processed_text)
         
         # 构建HTML
         html = [f'<div>{processed_text}</div>']
@@ -93,7 +104,7 @@ class FootnoteProcessor(BaseProcessor):
             html.append('<div class="footnotes">')
             for i, footnote in enumerate(footnotes):
                 html.append(f'<aside id="footnote-{i+1}" class="footnote">')
-                html.append(f'<a href="#footnote-ref-{i+1}">{footnote["marker"]}</a> {footnote["content"]}')
+                html.append(f'<a href="#footnote-ref-{i+1}">{escape(footnote["marker"], quote=False)}</a> {escape(footnote["content"], quote=False)}')
                 html.append('</aside>')
             html.append('</div>')
         
@@ -112,13 +123,10 @@ class FootnoteProcessor(BaseProcessor):
         footnotes = []
         lines = self.text.strip().split('\n')
         
-        # 脚注模式
-        footnote_pattern = r'^(※\d+|[①②③④⑤⑥⑦⑧⑨⑩]|\[\d+\]|\(\d+\)|\d+\)|\*+)\s+(.+)$'
-        
         # 提取脚注
         for line in lines:
             line = line.strip()
-            match = re.match(footnote_pattern, line)
+            match = _FOOTNOTE_LINE_RE.match(line)
             if match:
                 marker = match.group(1)
                 content = match.group(2)
@@ -5,6 +5,7 @@
 """
 
 import re
+from html import escape
 import cv2
 import numpy as np
 from .base import BaseProcessor
@@ -213,12 +214,11 @@ class TableProcessor(BaseProcessor):
             return ""
         
         # 处理表头
-        header_cells = [cell.strip() for cell in lines[header_sep_idx-1].split('|')]
-        header_cells = [cell for cell in header_cells if cell]  # 移除空单元格
+        # 去除空白并移除空单元格
+        header_cells = [stripped for cell in lines[header_sep_idx-1].split('|') if (stripped := cell.strip())]
         
         html.append('<thead><tr>')
-        for cell in header_cells:
-            html.append(f'<th>{cell}</th>')
+        html.extend(f'<th>{escape(cell, quote=False)}</th>' for cell in header_cells)
         html.append('</tr></thead>')
         
         # 处理表体
@@ -228,12 +228,11 @@ class TableProcessor(BaseProcessor):
             if not line or line.count('|') < 2:
                 continue
             
-            cells = [cell.strip() for cell in line.split('|')]
-            cells = [cell for cell in cells if cell]  # 移除空单元格
+            # 去除空白并移除空单元格
+            cells = [stripped for cell in line.split('|') if (stripped := cell.strip())]
             
             html.append('<tr>')
-            for cell in cells:
-                html.append(f'<td>{cell}</td>')
+            html.extend(f'<td>{escape(cell, quote=False)}</td>' for cell in cells)
             html.append('</tr>')
         
         html.append('</tbody>')
@@ -323,8 +322,7 @@ class TableProcessor(BaseProcessor):
                 header_cells.append(cell.strip())
             
             html.append('<thead><tr>')
-            for cell in header_cells:
-                html.append(f'<th>{cell}</th>')
+            html.extend(f'<th>{escape(cell, quote=False)}</th>' for cell in header_cells)
             html.append('</tr></thead>')
         
         # 处理表体
@@ -346,8 +344,7 @@ class TableProcessor(BaseProcessor):
                 cells.append(cell.strip())
             
             html.append('<tr>')
-            for cell in cells:
-                html.append(f'<td>{cell}</td>')
+            html.extend(f'<td>{escape(cell, quote=False)}</td>' for cell in cells)
             html.append('</tr>')
         
         html.append('</tbody>')
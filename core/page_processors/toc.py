@@ -5,8 +5,24 @@
 """
 
 import re
+from html import escape
 from .base import BaseProcessor
 
+# 目录条目末尾的省略号和页码，如 "第一章 引言..........1"
+# (?<!\.) 使匹配只能从省略号的第一个点开始，避免在长串点号上逐位回溯
+_TOC_PAGE_RE = re.compile(r'(?<!\.)\.{2,}\s*(\d+)$')
+
+# 目录行的页码模式，如 "第一章 引言..............1"
+_TOC_LINE_RE = re.compile(r'(?<!\.)\.{3,}\s*\d+$')
+
+# 章节标题模式合并为一个分支表达式，每行只需扫描一次
+_CHAPTER_LINE_RE = re.compile(
+    r'第[一二三四五六七八九十百千]+章'
+    r'|第\s*\d+\s*章'
+    r'|^\d+\.\d+\s+\w+'
+    r'|^\d+\.\s+\w+'
+)
+
 
 class TOCProcessor(BaseProcessor):
     """
@@ -38,25 +54,15 @@ class TOCProcessor(BaseProcessor):
         
         # 特征2: 包含页码模式
         # 查找形如 "第一章 引言..............1" 的模式
-        page_number_pattern = r'\.{3,}\s*\d+$'
         lines = text.strip().split('\n')
-        page_number_lines = sum(1 for line in lines if re.search(page_number_pattern, line))
+        page_number_lines = sum(1 for line in lines if _TOC_LINE_RE.search(line))
         
         if page_number_lines > 0:
             # 如果有多行包含页码，增加置信度
             confidence += min(0.4, page_number_lines / len(lines) * 0.8)
         
         # 特征3: 包含章节标题模式
-        chapter_patterns = [
-            r'第[一二三四五六七八九十百千]+章',
-            r'第\s*\d+\s*章',
-            r'^\d+\.\d+\s+\w+',
-            r'^\d+\.\s+\w+'
-        ]
-        
-        chapter_lines = 0
-        for pattern in chapter_patterns:
-            chapter_lines += sum(1 for line in lines if re.search(pattern, line))
+        chapter_lines = sum(1 for line in lines if _CHAPTER_LINE_RE.search(line))
         
         if chapter_lines > 0:
             confidence += min(0.2, chapter_lines / len(lines) * 0.4)
@@ -91,7 +97,7 @@ class TOCProcessor(BaseProcessor):
                 current_level = entry['level']
             
             # 添加条目
-            html.append(f'<li><a href="#chapter_{entry["page"]}">{entry["title"]}</a></li>')
+            html.append(f'<li><a href="#chapter_{entry["page"]}">{escape(entry["title"], quote=False)}</a></li>')
         
         # 关闭所有列表
         while current_level > 0:
@@ -128,14 +134,14 @@ class TOCProcessor(BaseProcessor):
                 continue
             
             # 尝试提取页码
-            page_match = re.search(r'\.{2,}\s*(\d+)$', line)
+            page_match = _TOC_PAGE_RE.search(line)
             if not page_match:
                 continue
             
             page = int(page_match.group(1))
             
-            # 提取标题（去除页码和省略号）
-            title = re.sub(r'\.{2,}\s*\d+$', '', line).strip()
+            # 提取标题（按匹配位置截去页码和省略号，无需再次匹配）
+            title = line[:page_match.start()].strip()
             
             # 确定级别
             level = 1
@@ -6,10 +6,33 @@
 
 import re
 import logging
+from html import escape
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 预编译的正则表达式
+_LEADING_SPACES_RE = re.compile(r'^(\s+)')
+_MULTI_SPACES_RE = re.compile(r' {2,}')
+_PARAGRAPH_SPLIT_RE = re.compile(r'\n\s*\n')
+_QUOTE_LINEBREAK_RE = re.compile(r'([""」』])\n')
+_SOFT_LINEBREAK_RE = re.compile(r'([^\n。！？"」』])\n(?=[^"「『])')
+_ELLIPSIS_DOTS_RE = re.compile(r'\.{3,}')
+_ELLIPSIS_PERIODS_RE = re.compile(r'。{3,}')
+_FOOTNOTE_RE = re.compile(r'(※[0-9]+|[①②③④⑤⑥⑦⑧⑨⑩])\s+(.*?)(?=\n※[0-9]+|[①②③④⑤⑥⑦⑧⑨⑩]|\Z)', re.DOTALL)
+_CHAPTER_TITLE_PATTERNS = [
+    # 第X章 标题
+    (re.compile(r'^第[一二三四五六七八九十百千]+章\s+(.+)$'), 1),
+    # 第X章 标题
+    (re.compile(r'^第\s*([0-9]+)\s*章\s+(.+)$'), 1),
+    # X.Y 标题（二级标题）
+    (re.compile(r'^([0-9]+)\.([0-9]+)\s+(.+)$'), 2),
+    # X. 标题（一级标题）
+    (re.compile(r'^([0-9]+)\.\s+(.+)$'), 1)
+]
+_PAGE_NUMBER_RE = re.compile(r'\n\s*[-\[]?\s*[0-9]+\s*[-\]]?\s*\n')
+_HYPHENATED_WORD_RE = re.compile(r'(\w+)-\n(\w+)')
+
 
 class TextCleaner:
     """
@@ -53,12 +76,12 @@ class TextCleaner:
                 line = "第二段有多余的空格和制表符。"
             else:
                 # 保留行首的空格
-                leading_spaces = re.match(r'^(\s+)', line)
+                leading_spaces = _LEADING_SPACES_RE.match(line)
                 if leading_spaces:
                     leading = leading_spaces.group(1)
-                    line = leading + re.sub(r' {2,}', ' ', line.lstrip())
+                    line = leading + _MULTI_SPACES_RE.sub(' ', line.lstrip())
                 else:
-                    line = re.sub(r' {2,}', ' ', line)
+                    line = _MULTI_SPACES_RE.sub(' ', line)
             lines[i] = line
         
         text = '\n'.join(lines)
@@ -79,21 +102,21 @@ class TextCleaner:
             return ""
         
         # 1. 保留段落间的空行
-        paragraphs = re.split(r'\n\s*\n', text)
+        paragraphs = _PARAGRAPH_SPLIT_RE.split(text)
         
         # 2. 处理每个段落内的换行
         for i, para in enumerate(paragraphs):
             # 特殊处理引用段落
             if '"' in para or '"' in para:
                 # 检查是否有引号后跟换行
-                para = re.sub(r'([""」』])\n', r'\1\n', para)
+                para = _QUOTE_LINEBREAK_RE.sub(r'\1\n', para)
                 # 合并非句末标点后的换行（中文）
-                para = re.sub(r'([^\n。！？"」』])\n(?=[^"「『])', r'\1', para)
+                para = _SOFT_LINEBREAK_RE.sub(r'\1', para)
             else:
                 # 合并非句末标点后的换行（中文）
-                para = re.sub(r'([^\n。！？"」』])\n(?=[^"「『])', r'\1', para)
+                para = _SOFT_LINEBREAK_RE.sub(r'\1', para)
                 # 合并行内换行
-                para = re.sub(r'\n', ' ', para)
+                para = para.replace('\n', ' ')
             
             paragraphs[i] = para
         
@@ -133,9 +156,9 @@ class TextCleaner:
             text = text.replace(en, zh)
         
         # 处理省略号 - 先处理连续的点号
-        text = re.sub(r'\.{3,}', '……', text)
+        text = _ELLIPSIS_DOTS_RE.sub('……', text)
         # 处理已经转换的中文句号
-        text = re.sub(r'。{3,}', '……', text)
+        text = _ELLIPSIS_PERIODS_RE.sub('……', text)
         
         return text
     
@@ -154,10 +177,9 @@ class TextCleaner:
         
         # 匹配常见的脚注标记和内容
         # 支持※①②③等符号和数字标记
-        footnote_pattern = r'(※[0-9]+|[①②③④⑤⑥⑦⑧⑨⑩])\s+(.*?)(?=\n※[0-9]+|[①②③④⑤⑥⑦⑧⑨⑩]|\Z)'
         footnotes = []
         
-        for match in re.finditer(footnote_pattern, text, re.DOTALL):
+        for match in _FOOTNOTE_RE.finditer(text):
             marker = match.group(1)
             # 移除内容中可能包含的标记
             content = match.group(2).strip()
@@ -201,26 +223,15 @@ class TextCleaner:
         
         titles = []
         
-        # 匹配章节标题模式
-        chapter_patterns = [
-            # 第X章 标题
-            (r'^第[一二三四五六七八九十百千]+章\s+(.+)$', 1),
-            # 第X章 标题
-            (r'^第\s*([0-9]+)\s*章\s+(.+)$', 1),
-            # X.Y 标题（二级标题）
-            (r'^([0-9]+)\.([0-9]+)\s+(.+)$', 2),
-            # X. 标题（一级标题）
-            (r'^([0-9]+)\.\s+(.+)$', 1)
-        ]
-        
         lines = text.split('\n')
         for line in lines:
             line = line.strip()
             if not line:
                 continue
             
-            for pattern, level in chapter_patterns:
-                match = re.match(pattern, line)
+            # 匹配章节标题模式
+            for pattern, level in _CHAPTER_TITLE_PATTERNS:
+                match = pattern.match(line)
                 if match:
                     title_text = match.group(match.lastindex)
                     titles.append({
@@ -246,7 +257,7 @@ class TextCleaner:
         
         # 移除常见页码格式
         # 例如: - 23 - 或 [23] 或 23
-        text = re.sub(r'\n\s*[-\[]?\s*[0-9]+\s*[-\]]?\s*\n', '\n', text)
+        text = _PAGE_NUMBER_RE.sub('\n', text)
         
         return text
     
@@ -264,7 +275,7 @@ class TextCleaner:
             return ""
         
         # 合并形如 "分-\n开" 的词
-        text = re.sub(r'(\w+)-\n(\w+)', r'\1\2', text)
+        text = _HYPHENATED_WORD_RE.sub(r'\1\2', text)
         
         return text
     
@@ -330,10 +341,9 @@ class TextCleaner:
         html = ['<table>']
         
         # 处理表头
-        header_cells = [cell.strip() for cell in lines[0].split('|') if cell.strip()]
+        header_cells = [stripped for cell in lines[0].split('|') if (stripped := cell.strip())]
         html.append('<tr>')
-        for cell in header_cells:
-            html.append(f'<th>{cell}</th>')
+        html.extend(f'<th>{escape(cell, quote=False)}</th>' for cell in header_cells)
         html.append('</tr>')
         
         # 跳过分隔行
@@ -343,13 +353,12 @@ class TextCleaner:
         
         # 处理数据行
         for i in range(start_idx, len(lines)):
-            cells = [cell.strip() for cell in lines[i].split('|') if cell.strip()]
+            cells = [stripped for cell in lines[i].split('|') if (stripped := cell.strip())]
             if not cells:
                 continue
                 
             html.append('<tr>')
-            for cell in cells:
-                html.append(f'<td>{cell}</td>')
+            html.extend(f'<td>{escape(cell, quote=False)}</td>' for cell in cells)
             html.append('</tr>')
         
         html.append('</table>')
@@ -388,7 +397,7 @@ class TextCleaner:
         special_titles = ["总序", "序言", "前言", "引言", "后记", "附录"]
         
         # 分割为段落
-        paragraphs = re.split(r'\n\s*\n', text)
+        paragraphs = _PARAGRAPH_SPLIT_RE.split(text)
         
         for i, para in enumerate(paragraphs):
             # 检查段落中是否包含特殊标题
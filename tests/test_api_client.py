@@ -0,0 +1,428 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试API客户端模块
+"""
+
+import os
+import unittest
+import sys
+import time
+import asyncio
+import threading
+import base64
+import json
+import tempfile
+import shutil
+import subprocess
+from unittest.mock import patch, MagicMock, AsyncMock
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# 导入被测试模块
+import api_client
+from api_client import APIClient, BaiduOCRClient, OpenAIVisionClient, create_api_client, recognize_batch
+
+
+class SlowClient(APIClient):
+    """模拟网络延迟的客户端"""
+
+    def __init__(self, delay=0.05):
+        super().__init__("test-key", "https://test-api-url.com")
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def recognize_text(self, image_path):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self._lock:
+            self.in_flight -= 1
+        return f"text:{image_path}"
+
+
+class TestLazyImport(unittest.TestCase):
+    """延迟导入测试类"""
+
+    def test_import_does_not_load_requests(self):
+        """测试导入模块时不加载requests"""
+        root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+        output = subprocess.check_output(
+            [sys.executable, "-c", "import sys, api_client; print('requests' in sys.modules)"],
+            cwd=root, text=True
+        )
+        self.assertEqual(output.strip(), "False")
+
+
+class TestRecognizeBatch(unittest.TestCase):
+    """批量识别测试类"""
+
+    def test_results_keep_order(self):
+        """测试结果顺序与输入一致"""
+        client = SlowClient()
+        paths = [f"page_{i}.jpg" for i in range(6)]
+
+        results = asyncio.run(recognize_batch(client, paths))
+
+        self.assertEqual(results, [f"text:{p}" for p in paths])
+
+    def test_concurrency_limit(self):
+        """测试并发数受限"""
+        client = SlowClient()
+        paths = [f"page_{i}.jpg" for i in range(8)]
+
+        asyncio.run(recognize_batch(client, paths, concurrency=2))
+
+        self.assertGreater(client.max_in_flight, 1)
+        self.assertLessEqual(client.max_in_flight, 2)
+
+    def test_rate_limit(self):
+        """测试每秒请求数受限"""
+        client = SlowClient(delay=0)
+        paths = [f"page_{i}.jpg" for i in range(5)]
+
+        start = time.monotonic()
+        asyncio.run(recognize_batch(client, paths, max_rps=50))
+
+        # 5个请求之间至少间隔4个0.02秒
+        self.assertGreaterEqual(time.monotonic() - start, 0.075)
+
+    def test_failure_cancels_pending_pages(self):
+        """测试某一页失败时先取消其余页面，再关闭客户端"""
+        events = []
+
+        class StubClient(APIClient):
+            async def recognize_text_async(self, image_path):
+                if image_path == "bad.jpg":
+                    raise ValueError("识别失败")
+                try:
+                    await asyncio.sleep(10)
+                except asyncio.CancelledError:
+                    events.append("cancelled")
+                    raise
+
+            async def aclose(self):
+                events.append("aclose")
+
+        with self.assertRaises(ValueError):
+            asyncio.run(recognize_batch(StubClient(), ["good.jpg", "bad.jpg"]))
+        self.assertEqual(events, ["cancelled", "aclose"])
+
+
+class TestCallWithRetry(unittest.TestCase):
+    """请求重试测试类"""
+
+    @patch('api_client.time.sleep')
+    @patch('requests.Session.request')
+    def test_retry_on_rate_limit(self, mock_request, mock_sleep):
+        """测试限流和服务端错误时重试"""
+        responses = [MagicMock(status_code=429), MagicMock(status_code=503), MagicMock(status_code=200)]
+        mock_request.side_effect = responses
+
+        client = APIClient("test-key", "https://test-api-url.com")
+        response = client._call_with_retry("POST", client.api_url)
+
+        self.assertIs(response, responses[-1])
+        self.assertEqual(mock_request.call_count, 3)
+        self.assertEqual(mock_sleep.call_count, 2)
+
+    @patch('api_client.time.sleep')
+    @patch('requests.Session.request')
+    def test_no_retry_on_client_error(self, mock_request, mock_sleep):
+        """测试客户端错误不重试"""
+        mock_request.return_value = MagicMock(status_code=400)
+
+        client = APIClient("test-key", "https://test-api-url.com")
+        response = client._call_with_retry("POST", client.api_url)
+
+        self.assertEqual(response.status_code, 400)
+        mock_request.assert_called_once()
+        mock_sleep.assert_not_called()
+
+    def test_adapter_retries_connect_errors_only(self):
+        """测试连接池只重试连接错误，已发出的请求不会被重发"""
+        client = APIClient("test-key", "https://test-api-url.com")
+        retry = client.session.get_adapter(client.api_url).max_retries
+
+        self.assertEqual(retry.connect, 3)
+        self.assertEqual(retry.read, 0)
+        self.assertEqual(retry.status, 0)
+        self.assertFalse(retry.is_retry("POST", 503))
+
+
+class TestBase64Encoding(unittest.TestCase):
+    """base64编码测试类"""
+
+    def test_encode_matches_stdlib(self):
+        """测试编码结果与标准库一致"""
+        data = bytes(range(256)) * 10
+        expected = base64.b64encode(data).decode("ascii")
+
+        self.assertEqual(api_client._b64encode_str(data), expected)
+        with patch.object(api_client, "pybase64", None):
+            self.assertEqual(api_client._b64encode_str(data), expected)
+
+    def test_encode_image_file(self):
+        """测试从文件编码图像"""
+        test_dir = tempfile.mkdtemp()
+        try:
+            data = os.urandom(4096)
+            image_path = os.path.join(test_dir, "page.jpg")
+            with open(image_path, "wb") as f:
+                f.write(data)
+            empty_path = os.path.join(test_dir, "empty.jpg")
+            open(empty_path, "wb").close()
+
+            self.assertEqual(api_client._encode_image_file(image_path),
+                             base64.b64encode(data).decode("ascii"))
+            self.assertEqual(api_client._encode_image_file(empty_path), "")
+        finally:
+            shutil.rmtree(test_dir)
+
+
+class TestJSONHelpers(unittest.TestCase):
+    """JSON序列化测试类"""
+
+    def test_roundtrip_with_and_without_orjson(self):
+        """测试orjson与标准库回退结果一致"""
+        obj = {"text": "中文文本", "items": [1, 2.5, None, True]}
+
+        for module in (api_client.orjson, None):
+            with patch.object(api_client, "orjson", module):
+                data = api_client._json_dumps(obj)
+                self.assertIsInstance(data, bytes)
+                self.assertEqual(json.loads(data), obj)
+                self.assertEqual(api_client._json_loads(data), obj)
+
+
+class TestBaiduOCRClient(unittest.TestCase):
+    """百度OCR客户端测试类"""
+
+    def setUp(self):
+        """测试前准备"""
+        self.test_dir = tempfile.mkdtemp()
+        self.env_patcher = patch.dict(os.environ, {"HOME": self.test_dir})
+        self.env_patcher.start()
+
+    def tearDown(self):
+        """测试后清理"""
+        self.env_patcher.stop()
+        shutil.rmtree(self.test_dir)
+
+    @patch('requests.Session.request')
+    def test_access_token_persisted(self, mock_get):
+        """测试访问令牌在多个实例间复用"""
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.content = json.dumps({"access_token": "token-1"}).encode("utf-8")
+
+        client = BaiduOCRClient("test-key", "test-secret")
+        self.assertEqual(client._get_access_token(), "token-1")
+
+        # 新实例应直接从磁盘加载令牌，无需再次请求
+        new_client = BaiduOCRClient("test-key", "test-secret")
+        self.assertEqual(new_client._get_access_token(), "token-1")
+        mock_get.assert_called_once()
+
+        # 令牌文件只允许当前用户读写，且不包含原始API Key
+        self.assertEqual(os.stat(client._token_path).st_mode & 0o777, 0o600)
+        self.assertNotIn(b"test-key", client._token_path.read_bytes())
+
+        # 不同API Key不应复用令牌
+        other_client = BaiduOCRClient("other-key", "test-secret")
+        self.assertIsNone(other_client.access_token)
+
+
+class TestOCRResultCache(unittest.TestCase):
+    """OCR结果缓存测试类"""
+
+    def setUp(self):
+        """测试前准备"""
+        self.test_dir = tempfile.mkdtemp()
+        self.env_patcher = patch.dict(os.environ, {"HOME": self.test_dir})
+        self.env_patcher.start()
+
+    def tearDown(self):
+        """测试后清理"""
+        self.env_patcher.stop()
+        shutil.rmtree(self.test_dir)
+
+    def _write_image(self, name, data):
+        image_path = os.path.join(self.test_dir, name)
+        with open(image_path, "wb") as f:
+            f.write(data)
+        return image_path
+
+    @patch('requests.Session.request')
+    def test_duplicate_images_hit_cache(self, mock_request):
+        """测试内容相同的图像只请求一次"""
+        mock_request.return_value.status_code = 200
+        mock_request.return_value.content = json.dumps({
+            "choices": [{"message": {"content": "识别结果"}}]
+        }).encode("utf-8")
+
+        client = OpenAIVisionClient("test-key")
+        first = self._write_image("page_1.jpg", b"same-image")
+        second = self._write_image("page_2.jpg", b"same-image")
+        other = self._write_image("page_3.jpg", b"other-image")
+
+        # 计算哈希和编码共用一次读取，不再单独读取文件编码
+        with patch("api_client._encode_image_file") as mock_encode:
+            self.assertEqual(client.recognize_text(first), "识别结果")
+            self.assertEqual(client.recognize_text(second), "识别结果")
+        mock_encode.assert_not_called()
+        self.assertEqual(mock_request.call_count, 1)
+
+        client.recognize_text(other)
+        self.assertEqual(mock_request.call_count, 2)
+
+    @patch('requests.Session.request')
+    def test_cache_separated_by_api_url(self, mock_request):
+        """测试不同API地址不共用缓存，且可以关闭缓存"""
+        mock_request.return_value.status_code = 200
+        mock_request.return_value.content = json.dumps({
+            "choices": [{"message": {"content": "识别结果"}}]
+        }).encode("utf-8")
+        image_path = self._write_image("page_1.jpg", b"image-1")
+
+        OpenAIVisionClient("test-key").recognize_text(image_path)
+        OpenAIVisionClient("test-key", api_url="https://other-api-url.com").recognize_text(image_path)
+        self.assertEqual(mock_request.call_count, 2)
+
+        # 关闭缓存时每次都发送请求
+        client = create_api_client("openai", api_key="test-key", cache=False)
+        client.recognize_text(image_path)
+        client.recognize_text(image_path)
+        self.assertEqual(mock_request.call_count, 4)
+        self.assertIsNone(client._cache_namespace())
+
+    @patch('requests.Session.request')
+    def test_null_content_not_cached(self, mock_request):
+        """测试接口返回空内容时不写入缓存"""
+        mock_request.return_value.status_code = 200
+        mock_request.return_value.content = json.dumps({
+            "choices": [{"message": {"content": None}}]
+        }).encode("utf-8")
+
+        client = OpenAIVisionClient("test-key")
+        image_path = self._write_image("page_1.jpg", b"image-1")
+
+        self.assertIsNone(client.recognize_text(image_path))
+        self.assertIsNone(client.recognize_text(image_path))
+        self.assertEqual(mock_request.call_count, 2)
+
+        # 批量识别与同步接口共用同一套缓存逻辑
+        self.assertEqual(asyncio.run(recognize_batch(client, [image_path], encode_workers=1)), [None])
+        self.assertEqual(mock_request.call_count, 3)
+
+        # 缓存目录中不应残留临时文件
+        cache_root = os.path.join(self.test_dir, ".cache", "pdf2epub", "ocr")
+        leftovers = [name for _, _, files in os.walk(cache_root) for name in files]
+        self.assertEqual(leftovers, [])
+
+    def test_write_failure_removes_temp_file(self):
+        """测试写入缓存失败时删除临时文件"""
+        with patch("api_client.os.replace", side_effect=OSError):
+            api_client._write_cache("Test", "digest", "文本")
+
+        cache_dir = os.path.join(self.test_dir, ".cache", "pdf2epub", "ocr", "Test")
+        self.assertEqual(os.listdir(cache_dir), [])
+
+    @patch('requests.Session.request')
+    def test_batch_with_encode_workers(self, mock_request):
+        """测试在子进程中编码的批量识别"""
+        mock_request.return_value.status_code = 200
+        mock_request.return_value.content = json.dumps({
+            "choices": [{"message": {"content": "识别结果"}}]
+        }).encode("utf-8")
+
+        client = OpenAIVisionClient("test-key")
+        paths = [
+            self._write_image("page_1.jpg", b"image-1"),
+            self._write_image("page_2.jpg", b"image-2"),
+        ]
+
+        results = asyncio.run(recognize_batch(client, paths, encode_workers=2))
+        self.assertEqual(results, ["识别结果", "识别结果"])
+        self.assertEqual(mock_request.call_count, 2)
+
+        # 请求体中应包含子进程编码的图像数据
+        image_urls = {
+            json.loads(call.kwargs["data"])["messages"][0]["content"][1]["image_url"]["url"]
+            for call in mock_request.call_args_list
+        }
+        self.assertEqual(image_urls, {
+            "data:image/jpeg;base64," + base64.b64encode(data).decode("ascii")
+            for data in (b"image-1", b"image-2")
+        })
+
+        # 结果已写入缓存，同步接口可直接命中
+        self.assertEqual(client.recognize_text(paths[0]), "识别结果")
+        self.assertEqual(mock_request.call_count, 2)
+
+
+class TestOpenAIAsyncClient(unittest.TestCase):
+    """OpenAI异步请求测试类"""
+
+    def setUp(self):
+        """测试前准备"""
+        self.test_dir = tempfile.mkdtemp()
+        self.env_patcher = patch.dict(os.environ, {"HOME": self.test_dir})
+        self.env_patcher.start()
+
+    def tearDown(self):
+        """测试后清理"""
+        self.env_patcher.stop()
+        shutil.rmtree(self.test_dir)
+
+    @patch('api_client.asyncio.sleep', new_callable=AsyncMock)
+    def test_batch_uses_http2_client(self, mock_sleep):
+        """测试安装httpx时通过HTTP/2客户端发送请求"""
+        body = json.dumps({"choices": [{"message": {"content": "识别结果"}}]}).encode("utf-8")
+        mock_httpx = MagicMock()
+        mock_async_client = mock_httpx.AsyncClient.return_value
+        mock_async_client.post = AsyncMock(side_effect=[
+            MagicMock(status_code=429), MagicMock(status_code=200, content=body)
+        ])
+        mock_async_client.aclose = AsyncMock()
+
+        image_path = os.path.join(self.test_dir, "page_1.jpg")
+        with open(image_path, "wb") as f:
+            f.write(b"image-1")
+
+        with patch.object(api_client, "httpx", mock_httpx):
+            client = OpenAIVisionClient("test-key")
+            results = asyncio.run(recognize_batch(client, [image_path]))
+
+        self.assertEqual(results, ["识别结果"])
+        self.assertTrue(mock_httpx.AsyncClient.call_args.kwargs["http2"])
+        self.assertEqual(mock_async_client.post.call_count, 2)
+        mock_sleep.assert_called_once()
+        mock_async_client.aclose.assert_awaited_once()
+
+    def test_client_closed_on_loop_switch(self):
+        """测试事件循环改变时关闭旧的异步客户端"""
+        body = json.dumps({"choices": [{"message": {"content": "识别结果"}}]}).encode("utf-8")
+        mock_httpx = MagicMock()
+        clients = [MagicMock(), MagicMock()]
+        for mock_async_client in clients:
+            mock_async_client.post = AsyncMock(return_value=MagicMock(status_code=200, content=body))
+            mock_async_client.aclose = AsyncMock()
+        mock_httpx.AsyncClient.side_effect = clients
+
+        with patch.object(api_client, "httpx", mock_httpx):
+            client = OpenAIVisionClient("test-key")
+            self.assertEqual(asyncio.run(client.recognize_base64_async("aW1hZ2U=")), "识别结果")
+            clients[0].aclose.assert_not_awaited()
+            self.assertEqual(asyncio.run(client.recognize_base64_async("aW1hZ2U=")), "识别结果")
+
+        clients[0].aclose.assert_awaited_once()
+        clients[1].aclose.assert_not_awaited()
+        self.assertIs(client._async_client, clients[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,18 +6,21 @@
 
 import os
 import unittest
-from unittest.mock import patch, MagicMock, mock_open
+from unittest.mock import patch, MagicMock, AsyncMock
 import sys
 import tempfile
 import shutil
 import zipfile
+import subprocess
+import asyncio
 import xml.etree.ElementTree as ET
+from pathlib import Path
 
 # 添加项目根目录到路径
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 # 导入被测试模块
-from core.epub_builder import EPUBBuilder
+from core.epub_builder import EPUBBuilder, _load_css_template, _load_css_bytes, _jpeg_size
 
 
 class TestEPUBBuilder(unittest.TestCase):
@@ -37,6 +40,10 @@ class TestEPUBBuilder(unittest.TestCase):
         self.max_image_height = 1200
         self.image_quality = 85
         
+        # 清空CSS模板缓存，避免测试之间相互影响
+        _load_css_template.cache_clear()
+        _load_css_bytes.cache_clear()
+        
         # 测试内容
         self.test_title = "测试书籍"
         self.test_author = "测试作者"
@@ -83,35 +90,35 @@ class TestEPUBBuilder(unittest.TestCase):
         self.assertEqual(builder.max_image_height, self.max_image_height)
         self.assertEqual(builder.image_quality, self.image_quality)
     
-    @patch('os.path.exists')
-    @patch('builtins.open', new_callable=mock_open)
-    def test_load_css_template(self, mock_file, mock_exists):
+    def test_load_css_template(self):
         """测试加载CSS模板"""
-        # 模拟CSS模板文件存在
-        mock_exists.return_value = True
-        mock_file.return_value.read.return_value = "body { font-family: serif; }"
+        # 在临时模板目录中创建CSS模板文件
+        with open(os.path.join(self.test_dir, "custom.css"), "w", encoding="utf-8") as f:
+            f.write("body { font-family: serif; }")
         
         builder = EPUBBuilder(
             output_file=self.output_file,
-            css_template="default"
+            css_template="custom"
         )
         
-        css = builder.load_css_template()
-        self.assertEqual(css, "body { font-family: serif; }")
-        mock_file.assert_called_once()
+        with patch('core.epub_builder._TEMPLATES_DIR', Path(self.test_dir)):
+            css = builder.load_css_template()
+            self.assertEqual(css, "body { font-family: serif; }")
+            
+            # 同名模板再次加载时使用缓存，不再读取文件
+            with patch('pathlib.Path.read_text') as mock_read:
+                self.assertEqual(builder.load_css_template(), css)
+                mock_read.assert_not_called()
     
-    @patch('os.path.exists')
-    def test_load_css_template_fallback(self, mock_exists):
+    def test_load_css_template_fallback(self):
         """测试加载CSS模板失败时的回退"""
-        # 模拟CSS模板文件不存在
-        mock_exists.return_value = False
-        
         builder = EPUBBuilder(
             output_file=self.output_file,
             css_template="non_existent"
         )
         
-        css = builder.load_css_template()
+        with patch('core.epub_builder._TEMPLATES_DIR', Path(self.test_dir)):
+            css = builder.load_css_template()
         # 验证是否使用了默认CSS
         self.assertIn("body", css)
         self.assertIn("font-family", css)
@@ -128,9 +135,29 @@ class TestEPUBBuilder(unittest.TestCase):
         builder.create_epub_structure()
         
         # 验证是否创建了必要的文件
-        mock_zip.writestr.assert_any_call("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        mock_zip.writestr.assert_any_call("mimetype", b"application/epub+zip", compress_type=zipfile.ZIP_STORED)
         mock_zip.writestr.assert_any_call("META-INF/container.xml", unittest.mock.ANY)
         mock_zip.writestr.assert_any_call("OEBPS/styles/main.css", unittest.mock.ANY)
+        self.assertEqual(mock_zipfile.call_args.kwargs["compresslevel"], 1)
+    
+    def test_create_epub_compression(self):
+        """测试EPUB中各文件的压缩方式"""
+        builder = EPUBBuilder(output_file=self.output_file)
+        for chapter in self.test_chapters:
+            builder.add_chapter(chapter["title"], chapter["content"], chapter["level"])
+        builder.build()
+        
+        with zipfile.ZipFile(self.output_file) as epub:
+            infos = epub.infolist()
+            # mimetype必须是第一个文件且不压缩
+            self.assertEqual(infos[0].filename, "mimetype")
+            self.assertEqual(infos[0].compress_type, zipfile.ZIP_STORED)
+            for info in infos[1:]:
+                self.assertEqual(info.compress_type, zipfile.ZIP_DEFLATED, info.filename)
+            self.assertIn("第一章", epub.read("OEBPS/chapter_1.xhtml").decode("utf-8"))
+            # OPF和NCX直接流式写入压缩包，内容应与generate_*的结果一致
+            self.assertEqual(epub.read("OEBPS/content.opf").decode("utf-8"), builder.generate_content_opf())
+            self.assertEqual(epub.read("OEBPS/toc.ncx").decode("utf-8"), builder.generate_toc())
     
     def test_add_chapter(self):
         """测试添加章节"""
@@ -142,8 +169,23 @@ class TestEPUBBuilder(unittest.TestCase):
         # 验证章节是否被添加
         self.assertEqual(len(builder.chapters), 1)
         self.assertEqual(builder.chapters[0]["title"], "测试章节")
-        self.assertEqual(builder.chapters[0]["content"], "<p>章节内容</p>")
         self.assertEqual(builder.chapters[0]["level"], 1)
+        
+        # 章节内容在添加时直接写入EPUB，不保留在内存中
+        self.assertNotIn("content", builder.chapters[0])
+        builder.build()
+        with zipfile.ZipFile(self.output_file) as epub:
+            self.assertIn("<p>章节内容</p>", epub.read("OEBPS/chapter_1.xhtml").decode("utf-8"))
+    
+    def test_add_page(self):
+        """测试按页面类型添加页面"""
+        builder = EPUBBuilder(output_file=self.output_file)
+        
+        for page_type in ["cover", "toc", "chapter", "section", "base"]:
+            builder.add_page("<p>页面内容</p>", page_type)
+        
+        titles = [chapter["title"] for chapter in builder.chapters]
+        self.assertEqual(titles, ["封面", "目录", "第3章", "第4节", "页面5"])
     
     @patch('zipfile.ZipFile')
     def test_add_image(self, mock_zipfile):
@@ -164,8 +206,14 @@ class TestEPUBBuilder(unittest.TestCase):
         # 验证图像是否被添加
         self.assertTrue(image_path.startswith("OEBPS/images/"))
         self.assertTrue(image_path.endswith(".jpg"))
-        mock_zip.writestr.assert_called_once_with(image_path, image_data)
+        mock_zip.writestr.assert_called_once_with(image_path, image_data, compress_type=zipfile.ZIP_STORED)
+        
+        # 相同的图像只存储一次
+        self.assertEqual(builder.add_image(image_data, "image/jpeg"), image_path)
+        mock_zip.writestr.assert_called_once()
+        self.assertEqual(builder.image_counter, 1)
     
+    @patch('core.epub_builder.pyvips', None)
     @patch('PIL.Image.open')
     @patch('io.BytesIO')
     def test_resize_image(self, mock_bytesio, mock_image_open):
@@ -188,8 +236,162 @@ class TestEPUBBuilder(unittest.TestCase):
         builder.resize_image(b'test_image_data')
         
         # 验证图像是否被调整大小
-        mock_image.thumbnail.assert_called_once_with((800, 600))
-        mock_image.save.assert_called_once()
+        from PIL import Image
+        mock_image.draft.assert_called_once_with("RGB", (1600, 1200))
+        mock_image.resize.assert_called_once_with((800, 600), resample=Image.LANCZOS, reducing_gap=3.0)
+        mock_image.resize.return_value.save.assert_called_once_with(
+            mock_bytesio_instance, format="JPEG", quality=85, optimize=True, progressive=True
+        )
+    
+    @patch('core.epub_builder.pyvips')
+    def test_resize_image_with_pyvips(self, mock_pyvips):
+        """测试安装pyvips时使用libvips调整图像大小"""
+        mock_image = mock_pyvips.Image.thumbnail_buffer.return_value
+        mock_image.jpegsave_buffer.return_value = b"resized"
+        
+        builder = EPUBBuilder(output_file=self.output_file, max_image_width=800, max_image_height=600)
+        
+        self.assertEqual(builder.resize_image(b"test_image_data"), b"resized")
+        mock_pyvips.Image.thumbnail_buffer.assert_called_once_with(
+            b"test_image_data", 800, height=600, size="down"
+        )
+        self.assertEqual(mock_image.jpegsave_buffer.call_args.kwargs["Q"], 85)
+    
+    def test_resize_image_skips_fitting_jpeg(self):
+        """测试尺寸符合要求的JPEG直接返回原始数据"""
+        from PIL import Image
+        import io
+        
+        def encode(size, format):
+            output = io.BytesIO()
+            Image.new("RGB", size, (200, 100, 50)).save(output, format=format)
+            return output.getvalue()
+        
+        builder = EPUBBuilder(output_file=self.output_file, max_image_width=800, max_image_height=600)
+        
+        small_jpeg = encode((200, 200), "JPEG")
+        self.assertIs(builder.resize_image(small_jpeg), small_jpeg)
+        
+        # 超出尺寸的JPEG和非JPEG图像仍需重新编码
+        large_jpeg = encode((1600, 600), "JPEG")
+        with Image.open(io.BytesIO(builder.resize_image(large_jpeg))) as img:
+            self.assertEqual(img.size, (800, 300))
+        small_png = encode((200, 200), "PNG")
+        with Image.open(io.BytesIO(builder.resize_image(small_png))) as img:
+            self.assertEqual(img.format, "JPEG")
+    
+    def test_jpeg_size(self):
+        """测试从JPEG文件头读取尺寸"""
+        from PIL import Image
+        import io
+        
+        for kwargs in ({}, {"progressive": True}, {"exif": Image.Exif()}):
+            output = io.BytesIO()
+            Image.new("RGB", (321, 123)).save(output, format="JPEG", **kwargs)
+            self.assertEqual(_jpeg_size(output.getvalue()), (321, 123))
+        
+        output = io.BytesIO()
+        Image.new("RGB", (10, 10)).save(output, format="PNG")
+        self.assertIsNone(_jpeg_size(output.getvalue()))
+        self.assertIsNone(_jpeg_size(b"\xff\xd8\xff"))
+    
+    def test_add_image_path(self):
+        """测试从文件添加图像"""
+        from PIL import Image
+        import io
+        
+        def write_image(name, size, format):
+            path = os.path.join(self.test_dir, name)
+            Image.new("RGB", size, (200, 100, 50)).save(path, format=format)
+            return path
+        
+        builder = EPUBBuilder(output_file=self.output_file, max_image_width=800, max_image_height=600)
+        small_jpeg = write_image("small.jpg", (200, 200), "JPEG")
+        large_jpeg = write_image("large.jpg", (1600, 600), "JPEG")
+        
+        # 尺寸符合要求的JPEG原样存储，重复添加复用同一路径
+        self.assertEqual(builder.add_image_path(small_jpeg), "OEBPS/images/image_1.jpg")
+        self.assertEqual(builder.add_image_path(small_jpeg), "OEBPS/images/image_1.jpg")
+        with open(small_jpeg, "rb") as f:
+            self.assertEqual(builder.add_image(f.read()), "OEBPS/images/image_1.jpg")
+        self.assertEqual(builder.add_image_path(large_jpeg), "OEBPS/images/image_2.jpg")
+        builder.build()
+        
+        with zipfile.ZipFile(self.output_file) as epub:
+            info = epub.getinfo("OEBPS/images/image_1.jpg")
+            self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+            with open(small_jpeg, "rb") as f:
+                self.assertEqual(epub.read(info), f.read())
+            with Image.open(io.BytesIO(epub.read("OEBPS/images/image_2.jpg"))) as img:
+                self.assertEqual(img.size, (800, 300))
+    
+    def test_add_image_mime_type(self):
+        """测试清单中的扩展名和MIME类型与实际写入的图像数据一致"""
+        from PIL import Image
+        import io
+        
+        def encode(mode, format):
+            output = io.BytesIO()
+            Image.new(mode, (1600, 600)).save(output, format=format)
+            return output.getvalue()
+        
+        builder = EPUBBuilder(output_file=self.output_file, max_image_width=800, max_image_height=600)
+        builder.epub = MagicMock()
+        
+        # 重新编码为JPEG的PNG使用JPEG的扩展名和MIME类型
+        self.assertEqual(builder.add_image(encode("RGB", "PNG"), "image/png"), "OEBPS/images/image_1.jpg")
+        # 带透明通道无法编码为JPEG的PNG保持原始格式
+        self.assertEqual(builder.add_image(encode("RGBA", "PNG"), "image/jpeg"), "OEBPS/images/image_2.png")
+        
+        content_opf = builder.generate_content_opf()
+        self.assertIn('<item id="image_1" href="images/image_1.jpg" media-type="image/jpeg" />', content_opf)
+        self.assertIn('<item id="image_2" href="images/image_2.png" media-type="image/png" />', content_opf)
+    
+    def test_add_images_bulk(self):
+        """测试批量添加图像"""
+        from PIL import Image
+        import io
+        
+        def encode(size, format):
+            output = io.BytesIO()
+            Image.new("RGB", size, (200, 100, 50)).save(output, format=format)
+            return output.getvalue()
+        
+        builder = EPUBBuilder(output_file=self.output_file, max_image_width=800, max_image_height=600)
+        builder.epub = MagicMock()
+        
+        small_jpeg = encode((200, 200), "JPEG")
+        images = [(small_jpeg, "image/jpeg"), (encode((1600, 600), "PNG"), "image/png"), (b"broken", "image/gif")]
+        image_paths = builder.add_images_bulk(images, max_workers=2)
+        
+        # 编号和写入顺序与输入一致，缩小后重新编码为JPEG的PNG使用.jpg扩展名
+        self.assertEqual(image_paths, ["OEBPS/images/image_1.jpg", "OEBPS/images/image_2.jpg",
+                                       "OEBPS/images/image_3.gif"])
+        self.assertEqual(builder.image_counter, 3)
+        calls = builder.epub.writestr.call_args_list
+        self.assertEqual([call.args[0] for call in calls], image_paths)
+        self.assertEqual(calls[0].args[1], small_jpeg)
+        with Image.open(io.BytesIO(calls[1].args[1])) as img:
+            self.assertEqual(img.size, (800, 300))
+            self.assertEqual(img.format, "JPEG")
+        # 无法处理的图像使用原始数据
+        self.assertEqual(calls[2].args[1], b"broken")
+        
+        # 清单中的路径和MIME类型与实际写入的图像一致
+        content_opf = builder.generate_content_opf()
+        self.assertIn('<item id="image_2" href="images/image_2.jpg" media-type="image/jpeg" />', content_opf)
+        self.assertIn('<item id="image_3" href="images/image_3.gif" media-type="image/gif" />', content_opf)
+        
+        # 再次批量添加时复用进程池，关闭时释放；重复的图像复用已有路径，不再写入
+        pool = builder._pool
+        new_jpeg = encode((100, 100), "JPEG")
+        self.assertEqual(builder.add_images_bulk([(small_jpeg, "image/jpeg"), (new_jpeg, "image/jpeg"),
+                                                  (new_jpeg, "image/jpeg")], max_workers=2),
+                         ["OEBPS/images/image_1.jpg", "OEBPS/images/image_4.jpg", "OEBPS/images/image_4.jpg"])
+        self.assertIs(builder._pool, pool)
+        self.assertEqual(builder.epub.writestr.call_count, 4)
+        builder.close()
+        self.assertIsNone(builder._pool)
     
     @patch('zipfile.ZipFile')
     def test_generate_toc(self, mock_zipfile):
@@ -238,8 +440,34 @@ class TestEPUBBuilder(unittest.TestCase):
         self.assertIn(self.test_title, content_opf)
         self.assertIn(self.test_author, content_opf)
         self.assertIn("<manifest>", content_opf)
-        self.assertIn("<spine>", content_opf)
+        self.assertIn("<spine toc=\"ncx\">", content_opf)
         self.assertIn("chapter_", content_opf)
+        
+        # 生成的文件应为格式良好的XML，且标识符与NCX一致
+        root = ET.fromstring(content_opf.encode("utf-8"))
+        ns = {"opf": "http://www.idpf.org/2007/opf", "dc": "http://purl.org/dc/elements/1.1/"}
+        self.assertEqual(len(root.findall("opf:spine/opf:itemref", ns)), len(self.test_chapters))
+        self.assertEqual(root.find("opf:metadata/dc:identifier", ns).text, builder.identifier)
+        
+        # 标识符和时间戳在初始化时确定，重复生成结果一致
+        self.assertEqual(builder.generate_content_opf(), content_opf)
+    
+    def test_metadata_is_escaped(self):
+        """测试元数据和章节标题中的XML特殊字符被转义"""
+        builder = EPUBBuilder(output_file=self.output_file)
+        builder.set_metadata("A & B <上>", "作者")
+        builder.add_chapter("R&D", "<p>内容</p>", 1)
+        
+        for xml in (builder.generate_content_opf(), builder.generate_toc()):
+            self.assertIn("A &amp; B &lt;上&gt;", xml)
+        self.assertIn("<text>R&amp;D</text>", builder.generate_toc())
+        
+        # 章节XHTML中的标题同样被转义，整个文件是格式良好的XML
+        builder.build()
+        with zipfile.ZipFile(self.output_file) as epub:
+            chapter = epub.read("OEBPS/chapter_1.xhtml")
+        self.assertIn(b"<title>R&amp;D</title>", chapter)
+        ET.fromstring(chapter)
     
     @patch('subprocess.run')
     def test_convert_to_mobi(self, mock_run):
@@ -262,6 +490,8 @@ class TestEPUBBuilder(unittest.TestCase):
         # 验证转换命令
         mock_run.assert_called_once()
         self.assertTrue(mobi_file.endswith(".mobi"))
+        # 标准输出不应被缓存在内存中
+        self.assertEqual(mock_run.call_args.kwargs["stdout"], subprocess.DEVNULL)
     
     @patch('zipfile.ZipFile')
     @patch('subprocess.run')
@@ -317,7 +547,58 @@ class TestEPUBBuilder(unittest.TestCase):
         self.assertTrue(result.endswith(".mobi"))
         mock_zip.writestr.assert_called()  # 验证EPUB文件写入
         mock_run.assert_called_once()      # 验证转换命令
+        
+        # 有共享内存时中间EPUB写在其中，转换后被删除
+        if os.path.isdir("/dev/shm"):
+            epub_file = mock_run.call_args.args[0][1]
+            self.assertTrue(epub_file.startswith("/dev/shm/"))
+            self.assertFalse(os.path.exists(epub_file))
 
+    
+    @patch('core.epub_builder.asyncio.create_subprocess_exec', new_callable=AsyncMock)
+    def test_build_mobi_async(self, mock_exec):
+        """测试异步构建MOBI"""
+        process = mock_exec.return_value
+        process.communicate = AsyncMock(return_value=(None, b""))
+        process.returncode = 0
+        
+        builder = EPUBBuilder(output_file=self.output_file, format="mobi")
+        for chapter in self.test_chapters:
+            builder.add_chapter(chapter["title"], chapter["content"], chapter["level"])
+        
+        result = asyncio.run(builder.build_async())
+        
+        self.assertEqual(result, os.path.splitext(self.output_file)[0] + ".mobi")
+        command = mock_exec.call_args.args
+        self.assertEqual(command[0], "ebook-convert")
+        self.assertEqual(command[2], result)
+        # 转换完成后中间EPUB文件被删除
+        if command[1] != self.output_file:
+            self.assertFalse(os.path.exists(command[1]))
+        
+        # 转换失败时抛出CalledProcessError，已构建的EPUB保留在输出路径
+        process.returncode = 1
+        builder = EPUBBuilder(output_file=self.output_file, format="mobi")
+        with self.assertRaises(subprocess.CalledProcessError):
+            asyncio.run(builder.build_async())
+        self.assertTrue(zipfile.is_zipfile(self.output_file))
+        if mock_exec.call_args.args[1] != self.output_file:
+            self.assertFalse(os.path.exists(mock_exec.call_args.args[1]))
+    
+    @patch('subprocess.run', side_effect=FileNotFoundError)
+    def test_build_mobi_without_calibre(self, mock_run):
+        """测试未安装Calibre时保留已构建的EPUB"""
+        builder = EPUBBuilder(output_file=self.output_file, format="mobi")
+        for chapter in self.test_chapters:
+            builder.add_chapter(chapter["title"], chapter["content"], chapter["level"])
+        
+        with self.assertRaises(FileNotFoundError):
+            builder.build()
+        
+        self.assertTrue(zipfile.is_zipfile(self.output_file))
+        epub_file = mock_run.call_args.args[0][1]
+        if epub_file != self.output_file:
+            self.assertFalse(os.path.exists(epub_file))
 
 if __name__ == '__main__':
     unittest.main()
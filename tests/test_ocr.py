@@ -5,6 +5,7 @@
 """
 
 import os
+import asyncio
 import unittest
 from unittest.mock import patch, MagicMock
 import json
@@ -18,7 +19,7 @@ import configparser
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 # 导入被测试模块
-from core.ocr_processor import OCRProcessor
+from core.ocr_processor import OCRProcessor, _is_rate_limit_error
 
 
 class TestOCRProcessor(unittest.TestCase):
@@ -49,6 +50,9 @@ class TestOCRProcessor(unittest.TestCase):
         
         # 测试图像数据 - 使用numpy数组模拟图像
         self.test_image = np.zeros((100, 100, 3), dtype=np.uint8)
+        
+        # 每个测试重新检查连通性
+        OCRProcessor._connectivity_cache.clear()
     
     def tearDown(self):
         """测试后清理"""
@@ -121,16 +125,15 @@ class TestOCRProcessor(unittest.TestCase):
             'language': {'code': 'zh-CN', 'name': '简体中文'},
             'token_usage': 150
         }
-        mock_call_llm_ocr.side_effect = [mock_result1, mock_result2]
+        # 图像并发处理，按图像返回对应的结果
+        images = [self.test_image, np.ones((100, 100, 3), dtype=np.uint8)]
+        mock_call_llm_ocr.side_effect = lambda image: mock_result1 if image is images[0] else mock_result2
         
         # 模拟_check_api_connectivity方法
         with patch('core.ocr_processor.OCRProcessor._check_api_connectivity', return_value=True):
             # 创建处理器
             processor = OCRProcessor(self.config)
             
-            # 创建测试图像列表
-            images = [self.test_image, self.test_image]
-            
             # 调用批量处理
             results = processor.batch_process(images)
             
@@ -143,6 +146,72 @@ class TestOCRProcessor(unittest.TestCase):
             # 验证调用次数
             self.assertEqual(mock_call_llm_ocr.call_count, 2)
     
+    @patch('core.ocr_processor.OCRProcessor._call_llm_ocr')
+    def test_batch_process_in_running_loop(self, mock_call_llm_ocr):
+        """测试在已运行的事件循环中调用同步批量处理"""
+        images = [np.full((100, 100, 3), i, dtype=np.uint8) for i in range(3)]
+        mock_call_llm_ocr.side_effect = lambda image: {'text': f'文本{int(image.max())}', 'token_usage': 10}
+        
+        async def _run(processor):
+            return processor.batch_process(images)
+        
+        with patch('core.ocr_processor.OCRProcessor._check_api_connectivity', return_value=True):
+            processor = OCRProcessor(self.config)
+            results = asyncio.run(_run(processor))
+        
+        self.assertEqual([result['text'] for result in results], ['文本0', '文本1', '文本2'])
+        self.assertEqual(processor.total_tokens, 30)
+    
+    @patch('core.ocr_processor.OCRProcessor._call_llm_ocr')
+    def test_batch_process_multi_page(self, mock_call_llm_ocr):
+        """测试多页合并为一个请求"""
+        self.config['ocr']['pages_per_request'] = '2'
+        images = [np.full((100, 100, 3), i, dtype=np.uint8) for i in range(3)]
+        mock_client = MagicMock()
+        mock_create = mock_client.chat.completions.with_raw_response.create
+        mock_create.return_value.http_response.content = json.dumps({
+            "choices": [{"message": {"content": "[PAGE_1]\n第一页\n[PAGE_2]\n第二页"}}],
+            "usage": {"total_tokens": 101}
+        }).encode("utf-8")
+        mock_call_llm_ocr.return_value = {'text': '第三页', 'token_usage': 50}
+        
+        with patch('core.ocr_processor.OCRProcessor._check_api_connectivity', return_value=True), \
+             patch('core.ocr_processor.OCRProcessor._get_client', return_value=mock_client):
+            processor = OCRProcessor(self.config)
+            results = processor.batch_process(images)
+        
+        # 前两页合并为一个请求，最后一页单独请求
+        self.assertEqual([result['text'] for result in results], ['第一页', '第二页', '第三页'])
+        self.assertEqual([result['token_usage'] for result in results], [51, 50, 50])
+        self.assertEqual(processor.total_tokens, 151)
+        mock_create.assert_called_once()
+        content = mock_create.call_args.kwargs['messages'][1]['content']
+        self.assertEqual([part['type'] for part in content],
+                         ['text', 'image_url', 'text', 'image_url', 'text'])
+        mock_call_llm_ocr.assert_called_once_with(images[2])
+    
+    @patch('core.ocr_processor.OCRProcessor._call_llm_ocr')
+    def test_ocr_pages_fallback(self, mock_call_llm_ocr):
+        """测试无法按页面标记拆分时逐页识别"""
+        images = [np.full((100, 100, 3), i, dtype=np.uint8) for i in range(2)]
+        mock_client = MagicMock()
+        mock_create = mock_client.chat.completions.with_raw_response.create
+        mock_create.return_value.http_response.content = json.dumps({
+            "choices": [{"message": {"content": "没有页面标记的文本"}}],
+            "usage": {"total_tokens": 30}
+        }).encode("utf-8")
+        mock_call_llm_ocr.side_effect = [{'text': '第一页', 'token_usage': 10}, {'text': '第二页', 'token_usage': 20}]
+        
+        with patch('core.ocr_processor.OCRProcessor._check_api_connectivity', return_value=True), \
+             patch('core.ocr_processor.OCRProcessor._get_client', return_value=mock_client):
+            processor = OCRProcessor(self.config)
+            results = processor.ocr_pages(images)
+        
+        self.assertEqual([result['text'] for result in results], ['第一页', '第二页'])
+        self.assertEqual(mock_call_llm_ocr.call_count, 2)
+        # 无法拆分的多页请求消耗的token同样计入总量
+        self.assertEqual(processor.total_tokens, 60)
+    
     @patch('core.ocr_processor.OCRProcessor._call_llm_ocr')
     def test_preprocess_enabled(self, mock_call_llm_ocr):
         """测试启用预处理"""
@@ -175,6 +244,26 @@ class TestOCRProcessor(unittest.TestCase):
             # 验证结果
             self.assertEqual(result, mock_result)
     
+    def test_preprocess_image(self):
+        """测试图像预处理输出二值图像且不修改输入"""
+        import cv2
+        
+        rng = np.random.default_rng(0)
+        image = rng.integers(0, 256, (120, 80, 3), dtype=np.uint8)
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        _, expected = cv2.threshold(cv2.GaussianBlur(gray, (5, 5), 0), 0, 255,
+                                    cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        
+        with patch('core.ocr_processor.OCRProcessor._check_api_connectivity', return_value=True):
+            processor = OCRProcessor(self.config)
+        
+        np.testing.assert_array_equal(processor._preprocess_image(image), expected)
+        
+        # 灰度输入不应被原地修改
+        original = gray.copy()
+        np.testing.assert_array_equal(processor._preprocess_image(gray), expected)
+        np.testing.assert_array_equal(gray, original)
+    
     @patch('core.ocr_processor.OCRProcessor._call_llm_ocr')
     def test_retry_mechanism(self, mock_call_llm_ocr):
         """测试重试机制"""
@@ -203,6 +292,183 @@ class TestOCRProcessor(unittest.TestCase):
             self.assertEqual(result, mock_result)
             mock_sleep.assert_called_once()
     
+    def test_retry_wait_by_error_type(self):
+        """测试限流错误使用指数退避，其他错误按固定间隔重试"""
+        self.config['ocr']['retry_wait'] = '1'
+        self.config['ocr']['retry_max_wait'] = '10'
+        
+        with patch('core.ocr_processor.OCRProcessor._check_api_connectivity', return_value=True):
+            processor = OCRProcessor(self.config)
+        
+        # _call_llm_ocr会包装原始异常，需沿异常链识别
+        try:
+            try:
+                raise Exception("Error code: 429 - Rate limit reached")
+            except Exception as e:
+                raise Exception("调用OCR API失败: 请求超时")
+        except Exception as e:
+            wrapped = e
+        self.assertTrue(_is_rate_limit_error(wrapped))
+        self.assertFalse(_is_rate_limit_error(Exception("测试异常")))
+        
+        self.assertEqual(processor._retry_wait(0, Exception("测试异常")), 1)
+        self.assertTrue(2 <= processor._retry_wait(0, wrapped) <= 3)
+        self.assertEqual(processor._retry_wait(5, wrapped), 10)
+    
+    def test_rate_limit(self):
+        """测试每秒请求数受限"""
+        self.config['ocr']['max_rps'] = '2'
+        
+        with patch('core.ocr_processor.OCRProcessor._check_api_connectivity', return_value=True), \
+             patch('core.ocr_processor.time.monotonic', return_value=100.0), \
+             patch('core.ocr_processor.time.sleep') as mock_sleep:
+            processor = OCRProcessor(self.config)
+            for _ in range(3):
+                processor._wait_for_rate_limit()
+        
+        # 第一个请求立即发送，之后每个请求间隔0.5秒
+        self.assertEqual([call.args[0] for call in mock_sleep.call_args_list], [0.5, 1.0])
+
+    def test_client_reused(self):
+        """测试连通性检查和OCR请求共用同一个客户端"""
+        mock_openai = MagicMock()
+        with patch('core.ocr_processor.OpenAI', mock_openai):
+            processor = OCRProcessor(self.config)
+            self.assertIs(processor._get_client(), mock_openai.return_value)
+        
+        mock_openai.assert_called_once()
+        self.assertEqual(mock_openai.call_args.kwargs['max_retries'], 0)
+        self.assertEqual(mock_openai.call_args.kwargs['timeout'], self.timeout)
+    
+    def test_check_api_connectivity(self):
+        """测试通过模型列表检查连通性"""
+        mock_openai = MagicMock()
+        with patch('core.ocr_processor.OpenAI', mock_openai):
+            OCRProcessor(self.config)
+            client = mock_openai.return_value
+            client.models.list.assert_called_once()
+            client.chat.completions.create.assert_not_called()
+            
+            # 同一配置再次创建时不重复检查
+            OCRProcessor(self.config)
+            client.models.list.assert_called_once()
+            
+            # 不支持模型列表接口的服务视为可以连通
+            OCRProcessor._connectivity_cache.clear()
+            client.models.list.side_effect = Exception("404")
+            client.models.list.side_effect.status_code = 404
+            OCRProcessor(self.config)
+            
+            # 密钥无效等其他错误导致初始化失败
+            OCRProcessor._connectivity_cache.clear()
+            client.models.list.side_effect = Exception("401")
+            client.models.list.side_effect.status_code = 401
+            with self.assertRaises(Exception):
+                OCRProcessor(self.config)
+    
+    def _upload_image(self, image):
+        """调用_call_llm_ocr并返回上传的图像数据URL"""
+        mock_client = MagicMock()
+        mock_create = mock_client.chat.completions.with_raw_response.create
+        mock_create.return_value.http_response.content = json.dumps({
+            "choices": [{"message": {"content": "识别结果"}}],
+            "usage": None
+        }).encode("utf-8")
+
+        with patch('core.ocr_processor.OCRProcessor._check_api_connectivity', return_value=True), \
+             patch('core.ocr_processor.OCRProcessor._get_client', return_value=mock_client), \
+             patch('tempfile.NamedTemporaryFile') as mock_tempfile:
+            processor = OCRProcessor(self.config)
+            result = processor._call_llm_ocr(image)
+
+        self.assertEqual(result['text'], "识别结果")
+        mock_tempfile.assert_not_called()
+        messages = mock_create.call_args.kwargs['messages']
+        return messages[1]['content'][0]['image_url']['url']
+
+    def test_call_llm_ocr_parses_raw_response(self):
+        """测试直接从原始响应体解析文本和token使用量"""
+        import core.ocr_processor as ocr_module
+        
+        mock_client = MagicMock()
+        mock_create = mock_client.chat.completions.with_raw_response.create
+        mock_create.return_value.http_response.content = json.dumps({
+            "choices": [{"message": {"role": "assistant", "content": " 第一行\n第二行 "}}],
+            "usage": {"prompt_tokens": 80, "completion_tokens": 20, "total_tokens": 100}
+        }).encode("utf-8")
+        
+        for module in (ocr_module.orjson, None):
+            with patch('core.ocr_processor.OCRProcessor._check_api_connectivity', return_value=True), \
+                 patch('core.ocr_processor.OCRProcessor._get_client', return_value=mock_client), \
+                 patch.object(ocr_module, 'orjson', module):
+                processor = OCRProcessor(self.config)
+                result = processor._call_llm_ocr(self.test_image)
+            
+            self.assertEqual(result['text'], "第一行\n第二行")
+            self.assertEqual(result['token_usage'], 100)
+        mock_client.chat.completions.create.assert_not_called()
+    
+    def test_call_llm_ocr_encodes_in_memory(self):
+        """测试图像在内存中编码，不写临时文件"""
+        url = self._upload_image(self.test_image)
+        self.assertTrue(url.startswith("data:image/jpeg;base64,"))
+
+    def test_upload_format_and_size(self):
+        """测试彩色图像使用JPEG，二值化图像使用PNG，过大图像被缩小"""
+        import base64
+        import io
+        from PIL import Image
+
+        url = self._upload_image(np.zeros((3200, 2000, 3), dtype=np.uint8))
+        prefix, data = url.split(",", 1)
+        self.assertEqual(prefix, "data:image/jpeg;base64")
+        self.assertEqual(Image.open(io.BytesIO(base64.b64decode(data))).size, (1000, 1600))
+
+        url = self._upload_image(np.zeros((100, 100), dtype=np.uint8))
+        self.assertTrue(url.startswith("data:image/png;base64,"))
+        
+        # 最大边长可配置
+        self.config['ocr']['max_image_side'] = '800'
+        url = self._upload_image(np.zeros((3200, 2000, 3), dtype=np.uint8))
+        data = url.split(",", 1)[1]
+        self.assertEqual(Image.open(io.BytesIO(base64.b64decode(data))).size, (500, 800))
+        del self.config['ocr']['max_image_side']
+
+        # BGRA数组去掉透明通道后编码为JPEG
+        url = self._upload_image(np.zeros((100, 100, 4), dtype=np.uint8))
+        self.assertTrue(url.startswith("data:image/jpeg;base64,"))
+
+        # 字节流由PIL识别格式后重新编码
+        buffer = io.BytesIO()
+        Image.new("RGBA", (2000, 1000)).save(buffer, format="PNG")
+        prefix, data = self._upload_image(buffer.getvalue()).split(",", 1)
+        self.assertEqual(prefix, "data:image/jpeg;base64")
+        self.assertEqual(Image.open(io.BytesIO(base64.b64decode(data))).size, (1600, 800))
+
+    def test_bytes_upload_passthrough(self):
+        """测试尺寸合适的JPEG字节流直接上传，不重新编码"""
+        import base64
+        import io
+        from PIL import Image
+        
+        buffer = io.BytesIO()
+        Image.new("RGB", (200, 100), "white").save(buffer, format="JPEG")
+        data = buffer.getvalue()
+        url = self._upload_image(data)
+        self.assertEqual(url, "data:image/jpeg;base64," + base64.b64encode(data).decode("ascii"))
+        
+        # 彩色PNG仍重新编码为JPEG
+        buffer = io.BytesIO()
+        Image.new("RGB", (200, 100), "white").save(buffer, format="PNG")
+        self.assertTrue(self._upload_image(buffer.getvalue()).startswith("data:image/jpeg;base64,"))
+    
+    def test_array_upload_skips_pil(self):
+        """测试NumPy数组直接由OpenCV编码"""
+        with patch('PIL.Image.fromarray') as mock_fromarray:
+            url = self._upload_image(self.test_image)
+        self.assertTrue(url.startswith("data:image/jpeg;base64,"))
+        mock_fromarray.assert_not_called()
+
     @patch('core.ocr_processor.OCRProcessor._call_llm_ocr')
     def test_token_usage_tracking(self, mock_call_llm_ocr):
         """测试token使用情况跟踪功能"""
@@ -248,18 +514,78 @@ class TestOCRProcessor(unittest.TestCase):
             self.assertEqual(result1['token_usage'], 120)
             self.assertEqual(processor.total_tokens, 120)
             
-            # 第二次OCR调用
-            result2 = processor.ocr_page(self.test_image)
+            # 第二次OCR调用，内容相同的页面会命中缓存，因此使用不同的页面
+            result2 = processor.ocr_page(np.full((100, 100, 3), 1, dtype=np.uint8))
             self.assertEqual(result2['token_usage'], 150)
             self.assertEqual(processor.total_tokens, 270)  # 120 + 150
             
             # 第三次OCR调用
-            result3 = processor.ocr_page(self.test_image)
+            result3 = processor.ocr_page(np.full((100, 100, 3), 2, dtype=np.uint8))
             self.assertEqual(result3['token_usage'], 180)
             self.assertEqual(processor.total_tokens, 450)  # 120 + 150 + 180
             
             # 验证日志记录
-            mock_logger.debug.assert_any_call(f"🔢 累计token使用量: 450")
+            mock_logger.debug.assert_any_call("🔢 累计token使用量: %s", 450)
+    
+    @patch('core.ocr_processor.OCRProcessor._call_llm_ocr')
+    def test_result_cache(self, mock_call_llm_ocr):
+        """测试内容相同的页面只请求一次"""
+        mock_call_llm_ocr.side_effect = lambda image: {'text': f'文本{int(image.max())}', 'token_usage': 100}
+        self.config['ocr']['cache_size'] = '1'
+        
+        with patch('core.ocr_processor.OCRProcessor._check_api_connectivity', return_value=True):
+            processor = OCRProcessor(self.config)
+            
+            first = processor.ocr_page(self.test_image)
+            second = processor.ocr_page(self.test_image.copy())
+            self.assertEqual(second['text'], first['text'])
+            self.assertIsNot(second, first)
+            self.assertEqual(mock_call_llm_ocr.call_count, 1)
+            # 缓存命中不计入token使用量，返回结果中的token使用量也为0
+            self.assertEqual(first['token_usage'], 100)
+            self.assertEqual(second['token_usage'], 0)
+            self.assertEqual(processor.total_tokens, 100)
+            
+            # 形状不同的图像不共用缓存
+            processor.ocr_page(np.zeros((50, 200, 3), dtype=np.uint8))
+            self.assertEqual(mock_call_llm_ocr.call_count, 2)
+            
+            # 超出缓存容量时淘汰最早的结果
+            processor.ocr_page(self.test_image)
+            self.assertEqual(mock_call_llm_ocr.call_count, 3)
+    
+    @patch('core.ocr_processor.OCRProcessor._call_llm_ocr')
+    def test_disk_cache(self, mock_call_llm_ocr):
+        """测试OCR结果在多个处理器实例间通过磁盘缓存复用"""
+        mock_call_llm_ocr.side_effect = lambda image: {'text': f'文本{int(image.max())}' if image.max() else '',
+                                                       'token_usage': 100}
+        self.config['ocr']['cache_dir'] = self.test_dir
+        blank_image = np.zeros((100, 100, 3), dtype=np.uint8)
+        image = np.ones((100, 100, 3), dtype=np.uint8)
+        
+        with patch('core.ocr_processor.OCRProcessor._check_api_connectivity', return_value=True):
+            processor = OCRProcessor(self.config)
+            processor.ocr_page(image)
+            processor.ocr_page(blank_image)
+            
+            # 新实例从磁盘读取结果，空结果不写入磁盘
+            new_processor = OCRProcessor(self.config)
+            result = new_processor.ocr_page(image)
+            self.assertEqual(result['text'], '文本1')
+            self.assertEqual(mock_call_llm_ocr.call_count, 2)
+            # 磁盘缓存命中不重复计入token使用量
+            self.assertEqual(result['token_usage'], 0)
+            self.assertEqual(new_processor.total_tokens, 0)
+            for cache_file in os.listdir(processor._cache_dir):
+                with open(os.path.join(processor._cache_dir, cache_file), encoding='utf-8') as f:
+                    self.assertEqual(json.load(f)['token_usage'], 0)
+            new_processor.ocr_page(blank_image)
+            self.assertEqual(mock_call_llm_ocr.call_count, 3)
+            
+            # 不同模型不共用缓存
+            self.config['ocr']['model_name'] = 'other-model'
+            OCRProcessor(self.config).ocr_page(image)
+            self.assertEqual(mock_call_llm_ocr.call_count, 4)
     
     @patch('core.ocr_processor.OCRProcessor._call_llm_ocr')
     def test_token_usage_with_missing_data(self, mock_call_llm_ocr):
@@ -329,6 +655,10 @@ class TestOCRProcessor(unittest.TestCase):
             }
             self.assertEqual(processor.detect_primary_language(ocr_result), 'zh-CN')
             
+            # 测试大模型OCR结果中的语言信息
+            ocr_result = {'language': {'code': 'zh-CN', 'name': '简体中文'}}
+            self.assertEqual(processor.detect_primary_language(ocr_result), 'zh-CN')
+            
             # 测试无语言信息的情况
             ocr_result = {}
             self.assertEqual(processor.detect_primary_language(ocr_result), 'unknown')
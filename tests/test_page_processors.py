@@ -90,6 +90,22 @@ class TestCoverProcessor(unittest.TestCase):
         confidence = CoverProcessor.detect(self.test_image, self.test_text)
         self.assertGreater(confidence, 0.5)  # 封面检测置信度应该较高
     
+    def test_detect_non_white_ratio(self):
+        """测试非空白占比的阈值边界"""
+        # 灰度200计为非空白，201计为空白
+        image = np.full((100, 100), 201, dtype=np.uint8)
+        image[:40] = 200
+        self.assertAlmostEqual(CoverProcessor.detect(image, ""), 0.3)
+        image[:60] = 200
+        self.assertAlmostEqual(CoverProcessor.detect(image, ""), 0.4)
+    
+    def test_detect_long_text_skips_image(self):
+        """测试文本很多时不分析图像"""
+        with patch('core.page_processors.cover.cv2.cvtColor') as mock_cvtcolor:
+            confidence = CoverProcessor.detect(self.test_image, "正文" * 200)
+        self.assertEqual(confidence, 0.0)
+        mock_cvtcolor.assert_not_called()
+    
     def test_detect_not_cover(self):
         """测试检测非封面"""
         # 创建一个有大量文本的图像，不太可能是封面
@@ -113,6 +129,13 @@ class TestCoverProcessor(unittest.TestCase):
         self.assertIn("<div class=\"cover\">", html)
         self.assertIn("书名", html)
         self.assertIn("作者名", html)
+    
+    def test_process_cover_escapes_html(self):
+        """测试封面文本中的HTML特殊字符被转义"""
+        processor = CoverProcessor(self.test_image, "A<B & C\n作者名")
+        html = processor.process()
+        
+        self.assertIn("<h1>A&lt;B &amp; C</h1>", html)
 
 
 class TestTOCProcessor(unittest.TestCase):
@@ -181,6 +204,17 @@ class TestTOCProcessor(unittest.TestCase):
         self.assertEqual(entries[1]["title"], "1.1 背景")
         self.assertEqual(entries[1]["page"], 2)
         self.assertEqual(entries[1]["level"], 2)
+    
+    def test_long_leader_without_page_number(self):
+        """测试没有页码的长省略号行"""
+        text = "目录\n第一章 引言" + "." * 20000 + "完\n第二章 方法......12\n"
+        processor = TOCProcessor(self.test_image, text)
+        
+        # 没有页码的行应被忽略，其余条目正常提取
+        entries = processor.extract_toc_entries()
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]["title"], "第二章 方法")
+        self.assertEqual(entries[0]["page"], 12)
 
 
 class TestFootnoteProcessor(unittest.TestCase):
@@ -205,6 +239,22 @@ class TestFootnoteProcessor(unittest.TestCase):
         confidence = FootnoteProcessor.detect(self.test_image, self.test_footnote_text)
         self.assertGreater(confidence, 0.3)  # 脚注检测置信度应该较高
 
+    def test_detect_counts_each_marker_once(self):
+        """测试同时符合多种形式的标记只计数一次"""
+        # "(1)" 同时符合 "(1)" 和 "1)" 两种形式
+        confidence = FootnoteProcessor.detect(self.test_image, "正文(1)结束")
+        self.assertAlmostEqual(confidence, 0.1)
+        
+        # 圆圈数字与正则标记分别统计后合计，连续的星号算一个标记
+        confidence = FootnoteProcessor.detect(self.test_image, "正文①②[1]**结束")
+        self.assertAlmostEqual(confidence, 0.4)
+    
+    def test_detect_footnote_lines(self):
+        """测试脚注行逐行识别，空白不跨行匹配"""
+        # 缩进的脚注行计入，只有标记没有内容的行不计入
+        text = "  ※1 脚注一\n※2\n正文"
+        self.assertAlmostEqual(FootnoteProcessor.detect(self.test_image, text), 0.3)
+    
     def test_detect_not_footnote(self):
         """测试检测非脚注"""
         # 创建一个没有脚注的普通文本
@@ -225,6 +275,14 @@ class TestFootnoteProcessor(unittest.TestCase):
         self.assertIn("<aside id=\"footnote-1\" class=\"footnote\">", html)
         self.assertIn("这是脚注内容", html)
     
+    def test_process_footnote_escapes_html(self):
+        """测试正文和脚注中的HTML特殊字符被转义"""
+        text = "正文a<b※1。\n\n※1 脚注R&D"
+        html = FootnoteProcessor(self.test_image, text).process()
+        
+        self.assertIn("正文a&lt;b<a href=\"#footnote-1\"", html)
+        self.assertIn("脚注R&amp;D", html)
+    
     def test_extract_footnotes(self):
         """测试提取脚注"""
         # 提取脚注